@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import tempfile
+import contextlib
+
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1' # keeps the pygame greeting out of the JSON on stdout
+
+import pygame
+
+from game import Game
+from scripts.enteties import Enemy
+from scripts.profiler import Profiler
+from scripts.tilemap import Tilemap
+
+# Benchmark suite for the game loop and the tilemap
+# Runs every level in data/maps, generated large maps and stress scenarios headless, and reports the frame time of every profiler zone
+# Run it from the PythonGame folder: python benchmark.py --output results.json --compare old_results.json
+
+# Inputs used while a scenario runs: hold right, jump and dash now and then
+JUMP_EVERY = 40
+DASH_EVERY = 75
+
+# Makes a long generated level: rolling grass hills with spikes, checkpoints, bushes, trees and enemies, saved in the normal map format
+def make_large_map(game, path, width=600, enemy_every=25, seed=0):
+    rng = random.Random(seed)
+    tilemap = Tilemap(game, tile_size=16)
+    heights = []
+    for x in range(width):
+        height = 12 + int(math.sin(x / 9) * 3 + math.sin(x / 23) * 4)
+        heights.append(height)
+        for y in range(height, height + 8):
+            tilemap.set_tile((x, y), 'grass', 8)
+        if x % 37 == 20:
+            tilemap.set_tile((x, height - 1), 'spikes', 0)
+        elif x % 61 == 30:
+            tilemap.set_tile((x, height - 1), 'checkpoints', 0)
+    tilemap.autotile()
+
+    for x in range(2, width, 7):
+        tilemap.add_offgrid({'type': 'bushes', 'variant': rng.randint(0, 1), 'pos': [x * 16 + rng.random() * 8, (heights[x] - 1) * 16 - 2]})
+    for x in range(5, width, 11):
+        tilemap.add_offgrid({'type': 'large_decor', 'variant': 2, 'pos': [x * 16, heights[x] * 16 - 44]})
+    tilemap.add_offgrid({'type': 'spawners', 'variant': 0, 'pos': [32, (heights[2] - 2) * 16]})
+    for x in range(40, width, enemy_every):
+        tilemap.add_offgrid({'type': 'spawners', 'variant': 1, 'pos': [x * 16, (heights[x] - 1) * 16]})
+    tilemap.save(path)
+
+# Makes a flat arena with a lot of enemies standing close together, for the stress scenarios
+def make_arena_map(game, path, width=120, enemies=60):
+    tilemap = Tilemap(game, tile_size=16)
+    for x in range(width):
+        for y in range(10, 14):
+            tilemap.set_tile((x, y), 'grass', 8)
+    tilemap.autotile()
+    tilemap.add_offgrid({'type': 'spawners', 'variant': 0, 'pos': [width * 8, 144]})
+    for i in range(enemies):
+        tilemap.add_offgrid({'type': 'spawners', 'variant': 1, 'pos': [32 + i * (width - 4) * 16 / enemies, 145]})
+    tilemap.save(path)
+
+# Scenario hooks, called every frame before the frame is stepped
+
+# Keeps the arena full of enemies near the player so every dash hits something
+def refill_enemies(game, frame):
+    while len(game.enemies) < 20:
+        side = 1 if random.random() < 0.5 else -1
+        game.enemies.append(Enemy(game, (game.player.pos[0] + side * random.randint(10, 60), game.player.pos[1]), (8, 15)))
+
+# Turns the player around and dashes as soon as the last dash is over
+def dash_back_and_forth(game, frame):
+    refill_enemies(game, frame)
+    if not game.player.dashing:
+        if frame % 120 < 60:
+            game.release(pygame.K_a)
+            game.press(pygame.K_d)
+        else:
+            game.release(pygame.K_d)
+            game.press(pygame.K_a)
+        game.player.update(game.tilemap, (game.movement[1] - game.movement[0], 0)) # face the new direction before dashing
+        game.player.dash()
+
+# Keeps the glowing particle field full
+def fill_glow(game, frame):
+    while len(game.glowing_particles) < 50:
+        game.glowing_particles.append([[game.player.pos[0] + random.randint(-250, 250), game.player.pos[1] + random.randint(-150, 150)], [random.randint(-2, 2) / 10, random.randint(-2, 2) / 10], 2])
+
+# Runs one scenario and returns its zone statistics
+def run_scenario(game, map_path, frames, warmup, seed, hook=None, scripted_input=True):
+    random.seed(seed)
+    game.checkpoint_claimed = [0, 0]
+    game.reset_timer()
+    game.movement = [False, False]
+    game.load_level(0, path=map_path)
+    game.profiler = Profiler(enabled=True, history=None)
+    for frame in range(warmup + frames):
+        if frame == warmup:
+            game.profiler.reset()
+        if scripted_input:
+            game.movement[1] = True
+            if frame % JUMP_EVERY == 0:
+                game.press(pygame.K_w)
+            if frame % DASH_EVERY == 0:
+                game.press(pygame.K_p)
+        if hook:
+            hook(game, frame)
+        game.step(render=True)
+    game.profiler.enabled = False
+    result = {'frames': frames, 'zones': game.profiler.stats()}
+    if game.tilemap.stream is not None:
+        result['chunk_reads'] = game.tilemap.stream.reads
+    return result
+
+# Times a function, returns microseconds per call, the mean and the best of the repeats
+def time_calls(function, args_list, repeats=5):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        for args in args_list:
+            function(*args)
+        times.append((time.perf_counter() - start) / len(args_list) * 1000000)
+    return {'calls': len(args_list), 'mean_us': sum(times) / len(times), 'best_us': min(times)}
+
+# Microbenchmarks of the tilemap queries on one map
+def run_micro(game, name, map_path, seed):
+    rng = random.Random(seed)
+    tilemap = Tilemap(game, tile_size=16)
+    tilemap.load(map_path)
+    bounds = tilemap.bounds()
+    points = [(rng.uniform(bounds[0], bounds[1] + 1) * 16, rng.uniform(bounds[2], bounds[3] + 1) * 16) for i in range(2000)]
+    rects = [(pygame.Rect(x, y, 8, 15),) for x, y in points]
+    special = [('bushes', 1), ('bushes', 0), ('collectables', 0), ('spawners', 0), ('spawners', 1), ('checkpoints', 0)]
+    return {
+        name + '/tiles_around': time_calls(tilemap.tiles_around, [(point,) for point in points]),
+        name + '/physics_rects_around': time_calls(tilemap.physics_rects_around, rects),
+        name + '/extract': time_calls(tilemap.extract, [(special, True)] * 20),
+        name + '/autotile': time_calls(tilemap.autotile, [()] * 5),
+        name + '/autotile_around': time_calls(tilemap.autotile_around, [((x // 16, y // 16),) for x, y in points]),
+        name + '/offgrid_at': time_calls(tilemap.offgrid_at, [(point,) for point in points]),
+        name + '/offgrid_overlapping': time_calls(tilemap.offgrid_overlapping, [((x - 160, y - 120, 320, 240),) for x, y in points[:200]]),
+    }
+
+# Compares the results against an older run, returns a line for every number that got slower than the threshold allows
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        if name not in baseline.get('scenarios', {}):
+            continue
+        for zone, stats in scenario['zones'].items():
+            old = baseline['scenarios'][name]['zones'].get(zone)
+            for key in ['mean', 'p95']:
+                if old and old[key] > 0.05 and stats[key] > old[key] * (1 + threshold):
+                    regressions.append('%s %s %s: %.3f ms -> %.3f ms' % (name, zone, key, old[key], stats[key]))
+    for name, stats in results['micro'].items():
+        old = baseline.get('micro', {}).get(name)
+        if old and stats['best_us'] > old['best_us'] * (1 + threshold):
+            regressions.append('%s: %.2f us -> %.2f us' % (name, old['best_us'], stats['best_us']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the game loop and the tilemap')
+    parser.add_argument('--frames', type=int, default=600, help='frames measured per scenario')
+    parser.add_argument('--warmup', type=int, default=60, help='frames run before measuring starts')
+    parser.add_argument('--only', default='', help='only run scenarios and microbenchmarks whose name contains this text')
+    parser.add_argument('--output', help='write the results as JSON to this file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of an older run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.15, help='how much slower (0.15 = 15%%) counts as a regression')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    # The headless game changes into the game folder, the files from the command line are relative to where the benchmark was started
+    output_path = os.path.abspath(args.output) if args.output else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'frames': args.frames,
+            'warmup': args.warmup,
+            'seed': args.seed,
+        },
+        'scenarios': {},
+        'micro': {},
+    }
+
+    # The progress lines go to stderr so stdout only has the results
+    with contextlib.redirect_stdout(sys.stderr):
+        game = Game(headless=True)
+        temp_dir = tempfile.mkdtemp()
+        large_map = os.path.join(temp_dir, 'large.json')
+        streamed_map = os.path.join(temp_dir, 'streamed.map')
+        arena_map = os.path.join(temp_dir, 'arena.json')
+        make_large_map(game, large_map, seed=args.seed)
+        make_large_map(game, streamed_map, width=4000, seed=args.seed) # big enough to be streamed from the file
+        make_arena_map(game, arena_map)
+
+        scenarios = {}
+        for level in range(game.level_count()):
+            scenarios['level_' + str(level)] = (game.level_path(level), None, True)
+        scenarios['large_map'] = (large_map, None, True)
+        scenarios['streamed_map'] = (streamed_map, None, True)
+        scenarios['many_enemies'] = (arena_map, None, False)
+        scenarios['dash_kills'] = (arena_map, dash_back_and_forth, False)
+        scenarios['glow_field'] = (large_map, fill_glow, True)
+
+        for name, (map_path, hook, scripted_input) in scenarios.items():
+            if args.only in name:
+                print('running', name)
+                results['scenarios'][name] = run_scenario(game, map_path, args.frames, args.warmup, args.seed, hook, scripted_input)
+
+        micro_maps = {'level_' + str(level): game.level_path(level) for level in range(game.level_count())}
+        micro_maps['large_map'] = large_map
+        for name, map_path in micro_maps.items():
+            for micro_name, stats in run_micro(game, name, map_path, args.seed).items():
+                if args.only in micro_name:
+                    results['micro'][micro_name] = stats
+
+        game.tilemap.clear() # closes the streamed file
+        for path in [large_map, streamed_map, arena_map]:
+            os.remove(path)
+        os.rmdir(temp_dir)
+
+    regressions = []
+    if compare_path:
+        f = open(compare_path, 'r')
+        regressions = find_regressions(results, json.load(f), args.threshold)
+        f.close()
+        results['regressions'] = regressions
+
+    # Short summary for people, the JSON is for comparing builds
+    for name, scenario in results['scenarios'].items():
+        frame = scenario['zones']['frame']
+        physics = scenario['zones'].get('physics', {'mean': 0}) # the tile collisions of every entity, also counted in the enemies and player zones
+        sys.stderr.write('%-14s frame mean %6.2f ms  p95 %6.2f ms  p99 %6.2f ms  physics mean %6.2f ms\n' % (name, frame['mean'], frame['p95'], frame['p99'], physics['mean']))
+    for line in regressions:
+        sys.stderr.write('REGRESSION ' + line + '\n')
+
+    if output_path:
+        f = open(output_path, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,24 @@
+import os
 import sys
 import pygame
 
-from scripts.utils import load_images  # Importing the load_images function from the utils module
-from scripts.tilemap import Tilemap    # Importing the Tilemap class from the tilemap module
+from scripts.assets import AssetManager  # Importing the asset manager that loads the tile images
+from scripts.tilemap import Tilemap, AUTOTILE_TYPES, PREFAB_PATH, save_prefab, load_prefab    # Importing the Tilemap class and the prefab files from the tilemap module
+from scripts.profiler import Profiler, ProfilerOverlay # Importing the frame profiler and its overlay
+from scripts.journal import EditJournal # Importing the edit journal that saves in the background and keeps the undo history
 
 
 
 RENDER_SCALE = 2.0 # Constant for render scale
 
+# Editing tools, picked with the number keys 1 to 5
+# brush: left places the current tile, right erases, one cell at a time
+# rect: drag with left to fill a rectangle with the current tile, drag with right to clear one (offgrid tiles too)
+# flood: left fills the area the clicked cell is part of with the current tile
+# copy: drag with left to copy a rectangle, right pastes it with its top left corner at the mouse, P saves the copy as a prefab
+# prefab: left stamps the prefab, pressing 5 again picks the next prefab
+TOOLS = ['brush', 'rect', 'flood', 'copy', 'prefab']
+
 
 class Editor:  # Defining the Editor class
     def __init__(self): # Initializing the Editor class
@@ -19,23 +30,10 @@ class Editor:  # Defining the Editor class
 
         self.clock = pygame.time.Clock() # Creating a Clock object to control the frame rate
 
-        # Dictionary containing image assets loaded from various directories
-        self.assets = {
-            'decor': load_images('tiles/decor'),
-            'grass': load_images('tiles/grass_new'),
-            'large_decor': load_images('tiles/large_decor'),
-            'rocks': load_images('tiles/rocks'),
-            'spikes': load_images('tiles/all_spikes/top_spikes'),
-            'spikes_right': load_images('tiles/all_spikes/right_spikes'),
-            'spikes_bot': load_images('tiles/all_spikes/bot_spikes'),
-            'spikes_left': load_images('tiles/all_spikes/left_spikes'),
-            'bushes': load_images('tiles/bushes'),
-            'crystals': load_images('tiles/crystals'),
-            'stone': load_images('tiles/stone_new'),
-            'spawners': load_images('tiles/spawners'),
-            'checkpoints': load_images('tiles/checkpoints'),
-            'collectables': load_images('tiles/collectables'),
-        }
+        # The tile images, from the same manifest and asset bundle as the game
+        self.asset_manager = AssetManager()
+        self.asset_manager.require('tiles')
+        self.assets = self.asset_manager.groups['tiles']
 
         # List to track movement directions
         self.movement = [False, False, False, False]
@@ -49,6 +47,10 @@ class Editor:  # Defining the Editor class
         except FileNotFoundError:
             pass
 
+        # Every edit goes through the journal, it saves the map in the background and is what undo and redo use
+        # Edits that weren't saved when the editor last crashed are put back here
+        self.journal = EditJournal(self.tilemap, 'map.json')
+
         self.scroll = [0, 0] # List to track scrolling
 
         self.tile_list = list(self.assets) # List of tile types
@@ -60,8 +62,53 @@ class Editor:  # Defining the Editor class
         self.shift = False  # Flag to track if shift key is pressed
         self.ongrid = True  # Flag to track if placing tiles on grid
 
+        self.tool = 'brush' # Current editing tool, one of TOOLS
+        self.drag_start = None # Grid position the rectangle being dragged starts at
+        self.drag_button = None # Mouse button the rectangle is dragged with
+        self.clipboard = None # Prefab made by the copy tool
+        self.prefabs = self.find_prefabs() # Prefab files that can be stamped
+        self.prefab = 0 # Index of the current prefab
+        self.status = '' # Last thing that happened, shown in the window title after the tool
+        if self.journal.recovered:
+            self.status = 'recovered %d edits from %s' % (self.journal.recovered, self.journal.journal_path)
+
+        # Frame profiler, F3 turns it and its overlay on and off, F4 writes the recorded frames to editor_profile.csv
+        self.profiler = Profiler()
+        self.profiler_overlay = ProfilerOverlay(self.profiler, pos=(self.screen.get_width() - 160, 10))
+        self.show_profiler = False
+
+        self.update_caption()
+
+    # Returns the prefab files in the prefab folder, in name order
+    def find_prefabs(self):
+        if not os.path.isdir(PREFAB_PATH):
+            return []
+        return sorted(name for name in os.listdir(PREFAB_PATH) if name.endswith('.json'))
+
+    # Picks a tool and shows it in the window title
+    def set_tool(self, tool):
+        self.tool = tool
+        self.drag_start = None
+        self.update_caption()
+
+    # Shows the tool and the status in the window title
+    def update_caption(self):
+        caption = 'editor - ' + self.tool
+        if self.tool == 'prefab':
+            caption += ' - ' + (self.prefabs[self.prefab] if self.prefabs else 'no prefabs in ' + PREFAB_PATH)
+        if self.status:
+            caption += ' - ' + self.status
+        pygame.display.set_caption(caption)
+
+    # The rectangle of grid cells between where the drag started and a grid position, both included
+    def drag_rect(self, tile_pos):
+        left, right = min(self.drag_start[0], tile_pos[0]), max(self.drag_start[0], tile_pos[0])
+        top, bottom = min(self.drag_start[1], tile_pos[1]), max(self.drag_start[1], tile_pos[1])
+        return pygame.Rect(left, top, right - left + 1, bottom - top + 1)
+
     def run(self): # Method to run the editor
         while True: # Main loop
+            self.profiler.begin_frame() # Starting the timing of this frame
             self.display.fill((0,0,0)) # Filling the display surface with black color
 
             # Updating scroll positions based on movement
@@ -70,10 +117,11 @@ class Editor:  # Defining the Editor class
             render_scroll = (int(self.scroll[0]), int(self.scroll[1]))  # Converting scroll positions to integers
 
             # Rendering the tilemap on the display surface
-            self.tilemap.render(self.display, offset=render_scroll)
+            with self.profiler.zone('tilemap'):
+                self.tilemap.render(self.display, offset=render_scroll)
 
             # Copying the current tile image and setting alpha value for transparency
-            current_tile_img = self.assets[self.tile_list[self.tile_group]][self.tile_variant].copy()
+            current_tile_img = self.assets[self.tile_list[self.tile_group]][self.tile_variant].surface().copy()
             current_tile_img.set_alpha(200)
 
             # Getting mouse position and scaling it
@@ -89,18 +137,23 @@ class Editor:  # Defining the Editor class
                 # Blitting current tile image at mouse position
                 self.display.blit(current_tile_img, mpos)
 
-            if self.clicking and self.ongrid: # If left mouse button is clicked and placing tiles on grid
-                # Adding tile to tilemap
-                self.tilemap.tilemap[str(tile_pos[0]) + ';' + str(tile_pos[1])] = {'type': self.tile_list[self.tile_group], 'variant': self.tile_variant, 'pos': tile_pos}
-            if self.right_clicking: # If right mouse button is clicked
-                tile_loc = str(tile_pos[0]) + ';' + str(tile_pos[1]) # Getting tile position as string
-                if tile_loc in self.tilemap.tilemap: # If tile position is in tilemap
-                    del self.tilemap.tilemap[tile_loc] # Deleting tile from tilemap
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile['type']][tile['variant']]
-                    tile_r = pygame.Rect(tile['pos'][0] - self.scroll[0], tile['pos'][1] - self.scroll[1], tile_img.get_width(), tile_img.get_height())
-                    if tile_r.collidepoint(mpos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+            if self.drag_start is not None: # Showing the rectangle being dragged
+                rect = self.drag_rect(tile_pos)
+                pygame.draw.rect(self.display, (255, 255, 255), (rect.x * self.tilemap.tile_size - self.scroll[0], rect.y * self.tilemap.tile_size - self.scroll[1], rect.w * self.tilemap.tile_size, rect.h * self.tilemap.tile_size), 1)
+
+            with self.profiler.zone('edit'): # Timing the placing and erasing of tiles
+                # The other tools only do something when a button is pressed or released
+                if self.tool == 'brush' and self.clicking and self.ongrid: # If left mouse button is clicked and placing tiles on grid
+                    # Adding tile to tilemap, the tile and its neighbours are autotiled right away
+                    # Holding the button over a tile that is already there does nothing, the autotiled variant of it doesn't count as different
+                    tile_type = self.tile_list[self.tile_group]
+                    tile = self.tilemap.get_tile(tile_pos)
+                    if not tile or tile['type'] != tile_type or (tile['variant'] != self.tile_variant and tile_type not in AUTOTILE_TYPES):
+                        self.journal.set_tile(tile_pos, tile_type, self.tile_variant)
+                if self.tool == 'brush' and self.right_clicking: # If right mouse button is clicked
+                    self.journal.remove_tile(tile_pos) # Deleting tile from tilemap if there is one
+                    for tile in self.tilemap.offgrid_at((mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])): # Deleting the offgrid tiles under the mouse
+                        self.journal.remove_offgrid(tile)
 
             # Blitting current tile image at position (5,5)
             self.display.blit(current_tile_img, (5,5))
@@ -108,17 +161,30 @@ class Editor:  # Defining the Editor class
 
             for event in pygame.event.get(): # Handling events
                 if event.type == pygame.QUIT: # If the window is closed
+                    self.journal.close() # Saving the map and waiting for it to be written
                     pygame.quit() # Quitting pygame
                     sys.exit() # Exiting the script
 
                 if event.type == pygame.MOUSEBUTTONDOWN: # If a mouse button is pressed
+                    if event.button == 1 or event.button == 3: # Everything placed or erased until the button is released is undone together
+                        self.journal.begin()
                     if event.button == 1: # Left mouse button
                         self.clicking = True # Setting clicking flag to True
-                        if not self.ongrid: # If not placing tiles on grid
-                            # Appending tile information to offgrid_tiles
-                            self.tilemap.offgrid_tiles.append({'type': self.tile_list[self.tile_group], 'variant': self.tile_variant, 'pos': (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])})
+                        if self.tool == 'brush' and not self.ongrid: # If not placing tiles on grid
+                            # Adding tile information to the offgrid tiles
+                            self.journal.add_offgrid({'type': self.tile_list[self.tile_group], 'variant': self.tile_variant, 'pos': (mpos[0] + self.scroll[0], mpos[1] + self.scroll[1])})
                     if event.button == 3: # Right mouse button
                         self.right_clicking = True # Setting right clicking flag to True
+                    if (event.button in (1, 3) and self.tool == 'rect') or (event.button == 1 and self.tool == 'copy'):
+                        self.drag_start = tile_pos # The rectangle is done when the button is released
+                        self.drag_button = event.button
+                    with self.profiler.zone('region'):
+                        if event.button == 1 and self.tool == 'flood':
+                            self.journal.flood_fill(tile_pos, self.tile_list[self.tile_group], self.tile_variant)
+                        if event.button == 3 and self.tool == 'copy' and self.clipboard:
+                            self.journal.paste(self.clipboard, tile_pos)
+                        if event.button == 1 and self.tool == 'prefab' and self.prefabs:
+                            self.journal.paste(load_prefab(PREFAB_PATH + self.prefabs[self.prefab]), tile_pos)
                     if self.shift: # If shift key is pressed
                         if event.button == 4: # Scroll up
                             self.tile_variant = (self.tile_variant - 1) % len(self.assets[self.tile_list[self.tile_group]])
@@ -132,6 +198,18 @@ class Editor:  # Defining the Editor class
                             self.tile_group = (self.tile_group + 1) % len(self.tile_list)
                             self.tile_variant = 0
                 if event.type == pygame.MOUSEBUTTONUP: # If a mouse button is released
+                    if event.button == self.drag_button and self.drag_start is not None:
+                        with self.profiler.zone('region'):
+                            rect = self.drag_rect(tile_pos)
+                            if self.tool == 'copy':
+                                self.clipboard = self.tilemap.copy_rect(rect)
+                            elif event.button == 1:
+                                self.journal.fill_rect(rect, self.tile_list[self.tile_group], self.tile_variant)
+                            else:
+                                self.journal.clear_rect(rect)
+                        self.drag_start = None
+                    if event.button == 1 or event.button == 3:
+                        self.journal.end()
                     if event.button == 1: # Left mouse button
                         self.clicking = False # Setting clicking flag to False
                     if event.button == 3: # Right mouse button
@@ -150,10 +228,38 @@ class Editor:  # Defining the Editor class
                         self.movement[3] = True
                     if event.key == pygame.K_g:
                         self.ongrid = not self.ongrid
-                    if event.key == pygame.K_t:
-                        self.tilemap.autotile()
-                    if event.key == pygame.K_o:
-                        self.tilemap.save('map.json')
+                    if event.key == pygame.K_t: # Autotiles the whole map at once, for maps made before the editor autotiled every edit
+                        with self.profiler.zone('autotile'):
+                            self.tilemap.autotile()
+                        self.journal.compact() # the batch isn't in the journal, so the map is saved right away
+                    if event.key == pygame.K_o: # Saves the map in the background, only copying the tiles happens in this frame
+                        with self.profiler.zone('save'):
+                            self.journal.compact()
+                    if event.key == pygame.K_z and event.mod & pygame.KMOD_CTRL: # Ctrl+Z undoes the last placing or erasing
+                        self.journal.undo()
+                    if event.key == pygame.K_y and event.mod & pygame.KMOD_CTRL: # Ctrl+Y redoes it
+                        self.journal.redo()
+                    if event.key in (pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4, pygame.K_5):
+                        tool = TOOLS[event.key - pygame.K_1]
+                        if tool == 'prefab' and self.tool == 'prefab' and self.prefabs: # 5 again picks the next prefab
+                            self.prefab = (self.prefab + 1) % len(self.prefabs)
+                        self.set_tool(tool)
+                    if event.key == pygame.K_p and self.clipboard: # Saves the copied rectangle as a new prefab
+                        os.makedirs(PREFAB_PATH, exist_ok=True)
+                        number = len(self.prefabs)
+                        while os.path.exists(PREFAB_PATH + 'prefab_%d.json' % number):
+                            number += 1
+                        name = 'prefab_%d.json' % number
+                        save_prefab(PREFAB_PATH + name, self.clipboard)
+                        self.prefabs = self.find_prefabs()
+                        self.status = 'saved ' + PREFAB_PATH + name
+                        self.update_caption()
+                    if event.key == pygame.K_F3:
+                        self.show_profiler = not self.show_profiler
+                        self.profiler.enabled = self.show_profiler
+                        self.profiler.reset()
+                    if event.key == pygame.K_F4:
+                        self.profiler.dump_csv('editor_profile.csv')
                     if event.key == pygame.K_LSHIFT:
                         self.shift = True
                 if event.type == pygame.KEYUP:
@@ -169,8 +275,14 @@ class Editor:  # Defining the Editor class
                         self.shift = False
 
             # Scaling and blitting the display surface onto the screen
-            self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0,0))
-            pygame.display.update()
+            with self.profiler.zone('scale'):
+                self.screen.blit(pygame.transform.scale(self.display, self.screen.get_size()), (0,0))
+            if self.show_profiler: # Drawing the profiler overlay on top of everything
+                self.profiler_overlay.render(self.screen)
+            with self.profiler.zone('present'):
+                pygame.display.update()
+            self.profiler.end_frame() # The frame is done, waiting for the next one doesn't count
             self.clock.tick(60)
 
-Editor().run() # Creating an instance of Editor class and running it
\ No newline at end of file
+if __name__ == '__main__': # Only open the editor when this file is run, not when it is imported
+    Editor().run() # Creating an instance of Editor class and running it
\ No newline at end of file
@@ -1,22 +1,53 @@
 import os
 import sys
 import math
+import time
 import random
 from ast import literal_eval # Importing specific items from a module
 
 import pygame # Importing a library for game development
 
-from scripts.utils import load_image, load_images, Animation, circle_surf
+from scripts.assets import AssetManager
+from scripts.audio import AudioEngine
+from scripts.spatial import SpatialHash
+from scripts.collectables import CollectableRegistry
 from scripts.enteties import PhysicsEntity, Player, Enemy
 from scripts.tilemap import Tilemap
 from scripts.clouds import Clouds
-from scripts.particle import Particle
-from scripts.spark import Spark
+from scripts.particle import ParticleSystem
+from scripts.spark import SparkSystem
+from scripts.projectile import ProjectileSystem
 from scripts.button import Button
+from scripts.glow import GlowCache
+from scripts.hud import HudText, format_time
+from scripts.outline import OutlineLayer, OUTLINE_OFFSETS, SHADOW_OFFSETS
+from scripts.profiler import Profiler, ProfilerOverlay
+
+# The game world moves forward in fixed steps of 1/60 of a second, no matter how fast the frames are drawn
+STEP = 1 / 60
+MAX_STEPS = 5 # most steps run before one frame is drawn, if the game is even further behind it slows down instead of freezing
+MAX_FPS = 120 # frames drawn per second at most, the frames between two steps are drawn in between the two positions
+
+# Levels with more chunks than this are streamed from their .map file, this many chunks are kept in memory
+STREAM_BUDGET = 512
+
+# Folder the game is in
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pixels an entity can move in one step at most, things further than this from the player can't hit it this step
+MAX_STEP_DISTANCE = 8
 
 # The game class, it is where the main game loop runs, and also has some game properties
 class Game: 
-    def __init__(self):
+    # headless runs the game without a window or sound card, for running simulations as fast as possible
+    def __init__(self, headless=False):
+        self.headless = headless
+        if headless:
+            # The dummy drivers have to be chosen before pygame starts
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+            # Every data path is relative to the game folder, batch jobs can be started from anywhere
+            os.chdir(GAME_DIR)
         pygame.init()
 
         # Setting up the display window
@@ -30,105 +61,89 @@ class Game:
         # Initializing game variables
         self.fullscreen = False
         self.main_menu_music_playing = False
-        self.timer = [0,0,0]  # Variable for keeping track of game time
-
-        # Loading best time from an external file   
-        if open("external_data.txt", "r").readline(-1):
+        self.timer = [0,0,0]  # Variable for keeping track of game time, [minutes, seconds, hundredths]
+        self.run_time = 0  # Seconds the timer has counted
+        self.running = False  # True while the game loop is running
+        self.render_random = random.Random()  # Random numbers that only change how a frame looks, like screenshake
+
+        # Loading best time from an external file, the headless mode doesn't use the file at all
+        self.best_time = [0,0,0]
+        if not headless and open("external_data.txt", "r").readline(-1):
             self.best_time = open("external_data.txt", "r").readline(-1)
             self.best_time = literal_eval(self.best_time)
             open("external_data.txt", "r").close()
-        else:
-            self.best_time = [0,0,0]
+        self.best_time_label = 'Best: ' + format_time(self.best_time) # only made again when the best time changes
 
-        # Initializing player movement, checkpoints, and collectibles
+        # Initializing player movement and checkpoints
         self.movement = [False, False]
         self.checkpoint_claimed = [0, 0]
-        self.collectables_aquired = []
-
-        # Loading game assets
-        # Loading images for various game elements
-        self.assets = {
-            'decor': load_images('tiles/decor'),
-            'grass': load_images('tiles/grass_new'),
-            'large_decor': load_images('tiles/large_decor'),
-            'rocks': load_images('tiles/rocks'),
-            'bushes': load_images('tiles/bushes'),
-            'crystals': load_images('tiles/crystals'),
-            'spikes': load_images('tiles/all_spikes/top_spikes'),
-            'spikes_right': load_images('tiles/all_spikes/right_spikes'),
-            'spikes_bot': load_images('tiles/all_spikes/bot_spikes'),
-            'spikes_left': load_images('tiles/all_spikes/left_spikes'),
-            'stone': load_images('tiles/stone_new'),
-            'checkpoints': load_images('tiles/checkpoints'),
-            'player': load_image('entities/player.png'),
-            'background': load_image('2.png'),
-            'clouds': load_images('clouds'),
-            'enemy/idle': Animation(load_images('entities/enemy/idle'), img_dur=6),
-            'enemy/run': Animation(load_images('entities/enemy/run'), img_dur=4),
-            'player/idle': Animation(load_images('entities/new_player/idle'), img_dur=6),
-            'player/run': Animation(load_images('entities/new_player/run'), img_dur=4),
-            'player/jump': Animation(load_images('entities/new_player/jump')),
-            'player/slide': Animation(load_images('entities/new_player/slide')),
-            'player/wall_slide': Animation(load_images('entities/new_player/wall_slide')),
-            'particle/leaf': Animation(load_images('particles/leaf'), img_dur=20, loop=False),
-            'particle/particle': Animation(load_images('particles/particle'), img_dur=6, loop=False),
-            'particle/particle_rain': Animation(load_images('particles/particle'), img_dur=200, loop=False),
-            'particle/collectables': Animation(load_images('tiles/collectables'), img_dur=40, loop=True),
-            'gun': load_image('gun.png'),
-            'projectile': load_image('projectile.png'),
-        }
-
-        # Loading buttons for the game UI
-        # Loading button images
-        self.buttons = {
-            'start': load_image('buttons/start_btn.png'),
-            'exit': load_image('buttons/exit_btn.png'),
-            '1': load_image('buttons/button1.png'),
-            'play': load_image('buttons/play.png'),
-            'logo': load_image('buttons/logo.png'),
-            'test': load_image('buttons/test.png'),
-            'play1': load_image('buttons/play1.png'),
-            'play1_hov': load_image('buttons/play1_hov.png'),
-        }
-
-        # Loading sound effects
-        self.sfx = {
-            'jump': pygame.mixer.Sound('data/sfx/jump.wav'),
-            'dash': pygame.mixer.Sound('data/sfx/dash.wav'),
-            'hit': pygame.mixer.Sound('data/sfx/hit.wav'),
-            'shoot': pygame.mixer.Sound('data/sfx/shoot.wav'),
-            'ambience': pygame.mixer.Sound('data/sfx/ambience.wav'),
-        }
-
-        # Setting volumes for sound effects
-        self.sfx['ambience'].set_volume(0.2)
-        self.sfx['shoot'].set_volume(0.4)
-        self.sfx['hit'].set_volume(0.8)
-        self.sfx['dash'].set_volume(0.3)
-        self.sfx['jump'].set_volume(0.7)
+
+        # Loading game assets, data/assets.json lists the images and sounds of every group
+        # Only the menu is loaded before the menu is shown, the tiles, sprites and sounds are loaded in the background and waited for when a level starts
+        self.asset_manager = AssetManager()
+        self.asset_manager.require('menu', 'buttons')
+        if not headless:
+            self.asset_manager.load_async('music', 'tiles', 'gameplay', 'sfx')
+        self.assets = self.asset_manager.assets # the tiles, entities and particles are texture atlas images, see scripts/atlas.py
+        self.buttons = self.asset_manager.groups['buttons']
+        self.sfx = self.asset_manager.groups['sfx'] # filled in when the group is loaded
+
+        # Every sound effect and song is played through the audio engine, it has a fixed amount of channels and doesn't play sounds far outside the camera view
+        self.audio = AudioEngine()
 
         # Initializing clouds in the game
         self.clouds = Clouds(self.assets['clouds'], count=16)
 
-        # Creating the player object
-        self.player = Player(self, (50,50), (8,15))
+        # Fonts for the timer and the best time, loaded once
+        self.timer_text = HudText('Times New Roman', 50)
+        self.best_time_text = HudText('Times New Roman', 20)
+
+        # Outlines of the sprites and tile chunks, made once and reused every frame
+        self.outline = OutlineLayer()
+
+        # Cache of the pre-made glow sprites for the glowing particles
+        self.glow_cache = GlowCache()
+
+        # Times the parts of every frame when it is turned on, used by the benchmarks and the overlay
+        # F3 turns the profiler and its overlay on and off, F4 writes the recorded frames to profile.csv
+        self.profiler = Profiler()
+        self.profiler_overlay = ProfilerOverlay(self.profiler, pos=(self.screen.get_width() - 160, 10)) # top right, away from the timer
+        self.show_profiler = False
+
+        # Spatial hash with the player and the enemies, so the code that checks what hits what only looks at the things nearby
+        # The entities keep their own place in it up to date when they move
+        self.entity_hash = SpatialHash()
+        self.dash_targets = set() # ids of the enemies close enough to the player to be hit by its dash this step
+
+        # The player object is made when the first level is loaded, its animations are gameplay assets
+        self.player = None
 
         # Initializing the tilemap
         self.tilemap = Tilemap(self, tile_size=16)
 
-        # Initializing the game level
+        # The gems of the level and the gems that were picked up
+        self.collectables = CollectableRegistry(self, tile_size=self.tilemap.tile_size)
+
+        # Initializing the particle, spark and projectile systems, they are emptied when a level is loaded
+        self.particles = ParticleSystem(self)
+        self.sparks = SparkSystem()
+        self.projectiles = ProjectileSystem(self)
+
+        # Initializing the game level, with a window the level is loaded when it is picked in the menu so the gameplay assets have time to load
         self.level = 0
-        self.load_level(self.level)
+        if headless:
+            self.load_level(self.level)
+
+    # Plays the main menu music once it has been decoded in the background, called every menu frame so the menu never waits for it
+    def menu_music(self):
+        if not self.main_menu_music_playing and self.asset_manager.ready('music'):
+            self.asset_manager.require('music')
+            self.audio.add_sounds(self.asset_manager.groups['music'], self.asset_manager.manifest['music'])
+            self.audio.play_music('menu', fade_ms=4000)
+            self.main_menu_music_playing = True
 
     # Method for displaying the main menu
     def main_menu(self):
-        
-        # Playing main menu music if not already playing
-        if not self.main_menu_music_playing:
-            pygame.mixer.music.load('data/main_menu_music.wav')
-            pygame.mixer.music.set_volume(0.2)
-            pygame.mixer.music.play(-1, 0, 4000)
-            self.main_menu_music_playing = True
 
         # Creating buttons for the main menu
         logo = Button((self.screen.get_width() / 2) - (self.buttons['logo'].get_width() // (2 / 10)), 50, self.buttons['logo'], self.buttons['logo'], 10)
@@ -139,6 +154,7 @@ class Game:
 
             # Drawing the main menu screen
             
+            self.menu_music()
             self.display_menu.blit(self.assets['background'], (0,0))
             self.clouds.update()
             self.clouds.render(self.display_menu, (0,0))
@@ -172,6 +188,7 @@ class Game:
         run = True
         while run:
             # Drawing the level selection screen
+            self.menu_music()
             self.display_menu.blit(self.assets['background'], (0,0))  # Setting background
             self.clouds.update()  # Updating clouds animation
             self.clouds.render(self.display_menu, (0,0))  # Rendering clouds
@@ -208,22 +225,42 @@ class Game:
             pygame.display.update()
             self.clock.tick(60)
 
-    # Method for loading a level
-    def load_level(self, map_id):
-        # Loading tilemap data from a JSON file
-        self.tilemap.load('data/maps/' + str(map_id) + '.json')
+    # Returns the file of a level, the binary .map file if there is one that isn't older than the json file
+    def level_path(self, map_id):
+        path = 'data/maps/' + str(map_id)
+        if os.path.exists(path + '.map') and (not os.path.exists(path + '.json') or os.path.getmtime(path + '.map') >= os.path.getmtime(path + '.json')):
+            return path + '.map'
+        return path + '.json'
+
+    # Returns the amount of levels, a level can have both a json and a .map file
+    def level_count(self):
+        return len(set(name.split('.')[0] for name in os.listdir('data/maps')))
+
+    # Makes sure the assets needed to play are loaded, the first time this waits for the background loading to be done
+    def require_gameplay(self):
+        self.asset_manager.require('tiles', 'gameplay', 'sfx')
+        if self.player is None:
+            self.audio.add_sounds(self.sfx, self.asset_manager.manifest['sfx'])
+            self.player = Player(self, (50,50), (8,15))
+
+    # Method for loading a level, path can point to a map file outside data/maps
+    def load_level(self, map_id, path=None):
+        self.require_gameplay()
+
+        # Loading tilemap data from the level file, dying loads the same file again
+        self.level_file = path or self.level_path(map_id)
+        self.tilemap.load(self.level_file, stream_budget=STREAM_BUDGET)
 
         # Extracting positions of leaf spawners from the tilemap
         self.leaf_spawners = []
         for tree in self.tilemap.extract([('bushes', 1), ('bushes', 0)], keep=True):
             self.leaf_spawners.append(pygame.Rect(2 + tree['pos'][0], 4 + tree['pos'][1], 22, 18))
 
-        # Extracting positions of collectables from the tilemap
-        self.collectables = []
-        for collectable in self.tilemap.extract([('collectables', 0)]):
-            self.collectables.append(pygame.Rect(collectable['pos'][0], collectable['pos'][1], 13, 13)) # change pos to topleft of the image not the whole picture
+        # Extracting positions of collectables from the tilemap, the picked up ones are remembered by level file and position
+        self.collectables.load(self.level_file, [collectable['pos'] for collectable in self.tilemap.extract([('collectables', 0)])])
 
-        # Extracting positions of enemies from the tilemap
+        # Extracting positions of enemies from the tilemap, the enemies add themselves to the emptied spatial hash
+        self.entity_hash.clear()
         self.enemies = []
         for spawner in self.tilemap.extract([('spawners', 0), ('spawners', 1)]):
             # If player hasn't claimed checkpoint, set player position to spawner position
@@ -234,36 +271,24 @@ class Game:
                 # Create enemy objects and add them to the enemies list
                 self.enemies.append(Enemy(self, spawner['pos'], (8, 15)))
 
-        # Determining the boundaries of the current map
-        self.current_mapsize = [0, 0, 0, 0]
-        for tile in self.tilemap.tilemap:
-            # Updating the minimum and maximum x and y coordinates
-            if int(tile.split(';')[0]) < self.current_mapsize[0]:
-                self.current_mapsize[0] = int(tile.split(';')[0])
-            elif int(tile.split(';')[0]) > self.current_mapsize[1]:
-                self.current_mapsize[1] = int(tile.split(';')[0])
-
-            if int(tile.split(';')[1]) < self.current_mapsize[2]:
-                self.current_mapsize[2] = int(tile.split(';')[1])
-            elif int(tile.split(';')[1]) > self.current_mapsize[3]:
-                self.current_mapsize[3] = int(tile.split(';')[1])
+        # Determining the boundaries of the current map, the map always includes the origin
+        bounds = self.tilemap.bounds()
+        self.current_mapsize = [min(0, bounds[0]), max(0, bounds[1]), min(0, bounds[2]), max(0, bounds[3])]
 
         # Initializing arrays to store temporary game elements
-        self.projectiles = []  # For projectiles
-        self.particles = []    # For particles
+        self.projectiles.clear() # For projectiles
+        self.particles.clear() # For particles
         self.glowing_particles = []  # For glowing particles
-        self.sparks = []       # For sparks
+        self.sparks.clear()    # For sparks
 
         # Initializing scroll position, death count, and other variables
         self.scroll = [0, 0]
+        self.prev_scroll = [0, 0]  # Scroll before the last update, the camera is drawn in between
+        self.render_scroll = (0, 0)
         self.dead = 0
         self.underwater = False  # Flag for underwater effect
         self.transition = -30    # Transition counter for level transition animation
 
-        # Creating collectables
-        for rect in self.collectables:
-            self.particles.append(Particle(self, 'collectables', (rect.x, rect.y)))
-
         # Handling checkpoint mechanics
         for checkpoint in self.tilemap.extract([('checkpoints', 0)], keep=True):
             if checkpoint['type'] == 'checkpoints' and checkpoint['variant'] == 0 and self.checkpoint_claimed != [0, 0]: # variant 1 is the second look of the checkpoint where it has been claimed
@@ -273,223 +298,184 @@ class Game:
                     self.player.pos = checkpoint['pos']
                     self.player.air_time = 0
 
-        # Initializing screenshake and printing collectables acquired
-        self.screenshake = 0
-        print(self.collectables_aquired)
+        # The player was moved to the spawn, it shouldn't be drawn sliding there from where it died
+        self.player.snap()
+        self.entity_hash.insert(self.player, self.player.rect())
+        self.prev_scroll = list(self.scroll)
 
-    # Method for running the game loop
-    def run(self):
-
-        # Switching music from main menu to game music
-        pygame.mixer.music.fadeout(500)
-
-        pygame.mixer.music.load('data/music.wav')
-        pygame.mixer.music.set_volume(0.5)
-        pygame.mixer.music.play(-1, 0, 2000)
-        self.main_menu_music_playing = False
-
-        # Playing ambient sound effects
-        self.sfx['ambience'].play(-1)
+        # Initializing screenshake
+        self.screenshake = 0
 
-        # Running the game loop
-        run = True
-        while run:
-            # Clearing display surfaces
-            self.display.fill((0,0,0,0))
-            self.display_2.blit(self.assets['background'], (0, 0))
-
-            # Decreasing screenshake effect
-            self.screenshake = max(0, self.screenshake - 1)
-
-            # Checking if all enemies are defeated
-            if not len(self.enemies):
-
-                # Managing level transition
-                self.transition += 1
-                if self.transition > 30:
-                    # Checking and updating best time if needed
-                    if self.timer[0] < self.best_time[0]:
-                        file = open("external_data.txt", "w")
-                        file.write(str(self.timer))
-                        file.close()
-                    elif self.timer[0] == self.best_time[0] and self.timer[1] < self.best_time[1]:
-                        file = open("external_data.txt", "w")
-                        file.write(str(self.timer))
-                        file.close()
-                    elif self.timer[0] == self.best_time[0] and self.timer[1] == self.best_time[1] and self.timer[2] < self.best_time[2]:
-                        file = open("external_data.txt", "w")
-                        file.write(str(self.timer))
-                        file.close()
-                    
-                    # Updating best time from file
-                    if open("external_data.txt", "r").readline(-1):
-                        self.best_time = open("external_data.txt", "r").readline(-1)
-                        self.best_time = literal_eval(self.best_time)
-                        open("external_data.txt", "r").close()
-                    else:
-                        self.best_time = [0,0,0]
-
-                    # Resetting timer
-                    self.timer = [0,0,0]
-
-                    self.checkpoint_claimed = [0,0]
-                    self.level = min(self.level + 1, len(os.listdir('data/maps')) - 1)
-                    self.load_level(self.level)
-            if self.transition < 0:
-                self.transition += 1
-
-            # Handling player death
-            if self.dead:
-                self.dead += 1
-                if self.dead >= 10:
-                    self.transition = min(30, self.transition + 1)
-                if self.dead > 40:
-                    self.player.velocity[0] = 0
-                    self.player.velocity[1] = 0
-                    self.load_level(self.level)
-
-            # Updating scroll position
-            self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 30
-            self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1]) / 30
-            render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
-
-            # random.random() is a number between 0 and 1
-            # Generating leaf particle effects
-            for rect in self.leaf_spawners:
-                if random.random() * 49999 < rect.width * rect.height:
-                    pos = (rect.x + random.random() * rect.width, rect.y + random.random() * rect.height)
-                    self.particles.append(Particle(self, 'leaf', pos, velocity=[-0.1, 0.3], frame=random.randint(0, 20)))
-
-            # Updating clouds animation
+    # Saves the timer as the new best time if it was faster, then reads the best time back from the file
+    # The headless mode never reads or writes the file, so simulation runs can't change the players best time
+    def save_best_time(self):
+        if self.headless:
+            return
+
+        # Checking and updating best time if needed
+        if self.timer[0] < self.best_time[0]:
+            file = open("external_data.txt", "w")
+            file.write(str(self.timer))
+            file.close()
+        elif self.timer[0] == self.best_time[0] and self.timer[1] < self.best_time[1]:
+            file = open("external_data.txt", "w")
+            file.write(str(self.timer))
+            file.close()
+        elif self.timer[0] == self.best_time[0] and self.timer[1] == self.best_time[1] and self.timer[2] < self.best_time[2]:
+            file = open("external_data.txt", "w")
+            file.write(str(self.timer))
+            file.close()
+
+        # Updating best time from file
+        if open("external_data.txt", "r").readline(-1):
+            self.best_time = open("external_data.txt", "r").readline(-1)
+            self.best_time = literal_eval(self.best_time)
+            open("external_data.txt", "r").close()
+        else:
+            self.best_time = [0,0,0]
+        self.best_time_label = 'Best: ' + format_time(self.best_time) # only made again when the best time changes
+
+    # Method for handling one event, keypresses, used by the game loop and to feed input in the headless mode
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            pygame.quit()
+            sys.exit()
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:
+                self.player.dash()
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_a:
+                self.movement[0] = True
+            if event.key == pygame.K_d:
+                self.movement[1] = True
+            if event.key == pygame.K_w or event.key == pygame.K_SPACE:
+                if self.player.jump():
+                    self.audio.play('jump')
+            if event.key == pygame.K_p:
+                self.player.dash()
+            if event.key == pygame.K_u:
+                self.underwater = not self.underwater
+            if event.key == pygame.K_f and not self.headless:
+                self.fullscreen = not self.fullscreen
+                if self.fullscreen:
+                    self.screen = pygame.display.set_mode((960, 720), pygame.FULLSCREEN)
+                else:
+                    self.screen = pygame.display.set_mode((960, 720))
+            if event.key == pygame.K_F3:
+                self.show_profiler = not self.show_profiler
+                self.profiler.enabled = self.show_profiler
+                self.profiler.reset()
+            if event.key == pygame.K_F4:
+                self.profiler.dump_csv('profile.csv')
+            if event.key == pygame.K_ESCAPE:
+                self.reset_timer()
+                self.running = False
+                self.audio.stop('ambience')
+                self.audio.stop_music()
+        if event.type == pygame.KEYUP:
+            if event.key == pygame.K_a:
+                self.movement[0] = False
+            if event.key == pygame.K_d:
+                self.movement[1] = False
+
+    # Presses a key like it came from the keyboard, meant for feeding input in the headless mode
+    def press(self, key):
+        self.handle_event(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+    # Releases a key like it came from the keyboard, meant for feeding input in the headless mode
+    def release(self, key):
+        self.handle_event(pygame.event.Event(pygame.KEYUP, key=key))
+
+    # Method for moving the game world forward one frame, nothing is drawn here
+    def update(self):
+        # Decreasing screenshake effect
+        self.screenshake = max(0, self.screenshake - 1)
+
+        # Checking if all enemies are defeated
+        if not len(self.enemies):
+
+            # Managing level transition
+            self.transition += 1
+            if self.transition > 30:
+                self.save_best_time()
+
+                # Resetting timer
+                self.reset_timer()
+
+                self.checkpoint_claimed = [0,0]
+                self.level = min(self.level + 1, self.level_count() - 1)
+                self.load_level(self.level)
+        if self.transition < 0:
+            self.transition += 1
+
+        # Handling player death
+        if self.dead:
+            self.dead += 1
+            if self.dead >= 10:
+                self.transition = min(30, self.transition + 1)
+            if self.dead > 40:
+                self.player.velocity[0] = 0
+                self.player.velocity[1] = 0
+                self.load_level(self.level, path=self.level_file)
+
+        # Updating scroll position
+        self.prev_scroll[0] = self.scroll[0]
+        self.prev_scroll[1] = self.scroll[1]
+        self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 30
+        self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1]) / 30
+        self.render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
+        render_scroll = self.render_scroll
+        self.audio.view = pygame.Rect(render_scroll, self.display.get_size()) # sounds are as loud as the camera hears them
+
+        # Big levels are streamed, the chunks around the camera and every entity are kept in memory and the chunks where the player is going are read ahead
+        if self.tilemap.stream is not None:
+            with self.profiler.zone('streaming'):
+                view = pygame.Rect(render_scroll, self.display.get_size())
+                rects = [view, self.player.rect()] + [enemy.rect() for enemy in self.enemies]
+                self.tilemap.stream_around(rects, (self.player.pos[0] - self.player.prev_pos[0], self.player.pos[1] - self.player.prev_pos[1]))
+
+        # random.random() is a number between 0 and 1
+        # Generating leaf particle effects
+        for rect in self.leaf_spawners:
+            if random.random() * 49999 < rect.width * rect.height:
+                pos = (rect.x + random.random() * rect.width, rect.y + random.random() * rect.height)
+                self.particles.spawn('leaf', pos, velocity=[-0.1, 0.3], frame=random.randint(0, 20))
+
+        # Updating clouds animation
+        with self.profiler.zone('clouds'):
             self.clouds.update()
-            self.clouds.render(self.display_2, offset=render_scroll)
-
-            # Rendering tilemap
-            self.tilemap.render(self.display, offset=render_scroll)
 
-            # Updating and rendering enemies
+        # Updating enemies
+        with self.profiler.zone('enemies'):
+            # Only the enemies near the player have to check if its dash hits them, the player moves after the enemies so its rect is the same for all of them
+            self.dash_targets = set()
+            if abs(self.player.dashing) >= 50:
+                self.dash_targets = {id(entity) for entity in self.entity_hash.query_rect(self.player.rect().inflate(MAX_STEP_DISTANCE * 2, MAX_STEP_DISTANCE * 2))}
             for enemy in self.enemies.copy():
                 kill = enemy.update(self.tilemap, (0,0))
-                enemy.render(self.display, offset=render_scroll)
                 if kill:
                     self.enemies.remove(enemy)
+                    self.entity_hash.remove(enemy)
 
-            # Updating player position and rendering player
+        # Updating player position
+        with self.profiler.zone('player'):
             if not self.dead:
                 self.player.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-                self.player.render(self.display, offset=render_scroll)
-
-
-            # Layout = [[x, y], direction , timer]
-            # Updating and rendering projectiles
-            for projectile in self.projectiles.copy():
-                projectile[0][0] += projectile[1]
-                projectile[2] += 1
-                img = self.assets['projectile']
-                self.display.blit(img, (projectile[0][0] - img.get_width() / 2 - render_scroll[0], projectile[0][1] - img.get_height() / 2 - render_scroll[1]))
-                if self.tilemap.solid_check(projectile[0]):
-                    self.projectiles.remove(projectile)
-                    for i in range(4):
-                        self.sparks.append(Spark(projectile[0], random.random() - 0.5 + (math.pi if projectile[1] > 0 else 0), 2 + random.random()))
-                elif projectile[2] > 360:
-                    self.projectiles.remove(projectile)
-                elif abs(self.player.dashing) < 50:
-                    if self.player.rect().collidepoint(projectile[0]):
-                        self.projectiles.remove(projectile)
-                        self.dead += 1
-                        self.sfx['hit'].play()
-                        self.screenshake = max(16, self.screenshake)
-                        for i in range(30):
-                            angle = random.random() * math.pi * 2
-                            speed = random.random() * 5
-                            self.sparks.append(Spark(self.player.rect().center, angle, 2 + random.random()))
-                            self.particles.append(Particle(self, 'particle', self.player.rect().center, velocity=[math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], frame=random.randint(0, 7)))
-
-            # Updating and rendering sparks
-            for spark in self.sparks.copy():
-                kill = spark.update()
-                spark.render(self.display, offset=render_scroll)
-                if kill:
-                    self.sparks.remove(spark)
-
-            # Creating display mask and silhouette for underwater effect
-            display_mask = pygame.mask.from_surface(self.display)
-            display_sillhouette = display_mask.to_surface(setcolor=(0,0,0,180), unsetcolor=(0,0,0,0))
-
-            # Rendering silhoutte
-            if not self.underwater:
-                for offset in [(-1,0), (1,0), (0,-1), (0,1)]:
-                    self.display_2.blit(display_sillhouette, offset)
-            else:
-                # Applying underwater effect
-                self.display_2.blit(display_sillhouette, offset)
-
-            
-
-            # Rendering particle effects
-            for index, particle in enumerate(self.particles.copy()):
-                kill = particle.update()
-                if particle.type != 'collectables':
-                    particle.render(self.display, offset=render_scroll)
-                else:
-                    particle.render(self.display, offset=render_scroll, gem=True)
 
-                if particle.type == 'leaf':
-                    particle.pos[0] += math.sin(particle.animation.frame * 0.035) * 0.3
-                if kill:
-                    self.particles.remove(particle)
-
-            # Handling events, keypresses
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == 1:
-                        self.player.dash()
-
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_a:
-                        self.movement[0] = True
-                    if event.key == pygame.K_d:
-                        self.movement[1] = True
-                    if event.key == pygame.K_w or event.key == pygame.K_SPACE:
-                        if self.player.jump():
-                            self.sfx['jump'].play()
-                    if event.key == pygame.K_p:
-                        self.player.dash()
-                    if event.key == pygame.K_u:
-                        self.underwater = not self.underwater
-                    if event.key == pygame.K_f:
-                        self.fullscreen = not self.fullscreen
-                        if self.fullscreen:
-                            self.screen = pygame.display.set_mode((960, 720), pygame.FULLSCREEN)
-                        else:
-                            self.screen = pygame.display.set_mode((960, 720))
-                    if event.key == pygame.K_ESCAPE:
-                        self.timer = [0,0,0]
-                        run = False
-                        self.sfx['ambience'].stop()
-                        pygame.mixer.music.stop()
-                        self.main_menu()
-                if event.type == pygame.KEYUP:
-                    if event.key == pygame.K_a:
-                        self.movement[0] = False
-                    if event.key == pygame.K_d:
-                        self.movement[1] = False
-
-            # Transition effect
-            if self.transition:
-                transition_surf = pygame.Surface(self.display.get_size()) # change 30 to change the radius of the circle
-                pygame.draw.circle(transition_surf, (255, 255, 255), (self.display.get_width() // 2, self.display.get_height() // 2), (30 - abs(self.transition)) * 8) # change 3rd argument to change the place the circle is being drawn at
-                transition_surf.set_colorkey((255, 255, 255))
-                self.display.blit(transition_surf, (0, 0))
+        # Updating projectiles
+        with self.profiler.zone('projectiles'):
+            self.projectiles.update()
 
-            # Draw the second display onto the main one
-            if not self.underwater:
-                self.display_2.blit(self.display, (0,0))
+        # Updating sparks and particle effects, stopped sparks and dead particles are removed by the update
+        with self.profiler.zone('sparks'):
+            self.sparks.update()
+        with self.profiler.zone('particles'):
+            self.collectables.update()
+            self.particles.update()
 
+        with self.profiler.zone('glow'):
             # Distributing the glowing particles in a good radius of the player and map
             if len(self.glowing_particles) < 50:
                 self.glowing_particles.append([[
@@ -502,50 +488,185 @@ class Game:
                     , random.randint(self.current_mapsize[2] * self.tilemap.tile_size - render_scroll[1], self.current_mapsize[3] * self.tilemap.tile_size - render_scroll[1])
                     ], [random.randint(-2, 2) / 10, random.randint(-2, 2) / 10], random.randint(2, 2)])
 
-
-            # Rendering glowing particle effects
-            for particle in self.glowing_particles:
+            # Moving glowing particles, removing the ones that faded out or are too far from the player
+            for particle in self.glowing_particles.copy():
                 particle[0][0] += particle[1][0]
                 particle[0][1] += particle[1][1]
                 particle[2] -= 0.001
 
-                self.display_2.blit(circle_surf(particle[2], (150,150,150)), ((int(particle[0][0] - render_scroll[0] - particle[2])), (int(particle[0][1] - render_scroll[1] - particle[2]))), special_flags=pygame.BLEND_RGB_ADD)
-                
-                for x in range(2, 10):
-                    radius = particle[2] * x
-                    self.display_2.blit(circle_surf(radius, (2,2,2)), ((int(particle[0][0] - render_scroll[0] - radius)), (int(particle[0][1] - render_scroll[1] - radius))), special_flags=pygame.BLEND_RGB_ADD)
-
                 if particle[2] <= 0:
                     self.glowing_particles.remove(particle)
-                if (particle[0][0] - render_scroll[0]) < (self.player.pos[0] - render_scroll[0] - 300) or (particle[0][0] - render_scroll[0]) > (self.player.pos[0] - render_scroll[0] + 300) or particle[0][1] < (self.player.pos[1] - render_scroll[1] - 300) or particle[0][1] > (self.player.pos[1] - render_scroll[1] + 300):
+                elif (particle[0][0] - render_scroll[0]) < (self.player.pos[0] - render_scroll[0] - 300) or (particle[0][0] - render_scroll[0]) > (self.player.pos[0] - render_scroll[0] + 300) or particle[0][1] < (self.player.pos[1] - render_scroll[1] - 300) or particle[0][1] > (self.player.pos[1] - render_scroll[1] + 300):
                     self.glowing_particles.remove(particle)
 
-            # Factoring the screenshake into the camera offset
-            screenshake_offset = (random.random() * self.screenshake - self.screenshake / 2, random.random() * self.screenshake - self.screenshake / 2)
+    # The player was hit by a projectile
+    def hit_player(self):
+        self.dead += 1
+        self.audio.play('hit')
+        self.screenshake = max(16, self.screenshake)
+        for i in range(30):
+            angle = random.random() * math.pi * 2
+            speed = random.random() * 5
+            self.sparks.spawn(self.player.rect().center, angle, 2 + random.random())
+            self.particles.spawn('particle', self.player.rect().center, velocity=[math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], frame=random.randint(0, 7))
+
+    # Adds time to the timer and updates the timer array
+    def advance_timer(self, seconds):
+        self.run_time += seconds
+        hundredths = int(self.run_time * 100 + 0.000001) # the tiny bit stops 300 steps of 1/60 from showing as 4.99 seconds
+        self.timer = [hundredths // 6000, hundredths // 100 % 60, hundredths % 100]
+
+    # Sets the timer back to zero
+    def reset_timer(self):
+        self.run_time = 0
+        self.timer = [0,0,0]
+
+    # Method for drawing the current frame to the screen, it doesn't change the game world
+    # alpha is how far (0 - 1) the game is between the last update and the next one, moving things are drawn that far between their last two positions
+    def render(self, alpha=1):
+        render_scroll = (int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha), int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha))
+
+        # Clearing display surfaces
+        self.display.fill((0,0,0,0))
+        self.display_2.blit(self.assets['background'], (0, 0))
+
+        # Rendering clouds
+        with self.profiler.zone('clouds'):
+            self.clouds.render(self.display_2, offset=render_scroll)
+
+        # The dark outlines (or the shadow when underwater) go on the background, every sprite draws its own pre-made outline
+        self.outline.begin(self.display_2, SHADOW_OFFSETS if self.underwater else OUTLINE_OFFSETS)
 
-            # Scaling up everything to the right size
+        # Rendering tilemap
+        with self.profiler.zone('tilemap'):
+            self.tilemap.render(self.display, offset=render_scroll, outline=self.outline)
+
+        # Rendering enemies
+        with self.profiler.zone('enemies'):
+            for enemy in self.enemies:
+                enemy.render(self.display, offset=render_scroll, alpha=alpha, outline=self.outline)
+
+        # Rendering player
+        with self.profiler.zone('player'):
+            if not self.dead:
+                self.player.render(self.display, offset=render_scroll, alpha=alpha, outline=self.outline)
+
+        # Rendering projectiles
+        with self.profiler.zone('projectiles'):
+            self.projectiles.render(self.display, self.assets['projectile'], offset=render_scroll, alpha=alpha, outline=self.outline)
+
+        # Rendering sparks
+        with self.profiler.zone('sparks'):
+            self.sparks.render(self.display, offset=render_scroll, outline=self.outline)
+
+        # Rendering particle effects
+        with self.profiler.zone('particles'):
+            self.collectables.render(self.display, offset=render_scroll)
+            self.particles.render(self.display, offset=render_scroll)
+
+        # Transition effect
+        with self.profiler.zone('transition'):
+            if self.transition:
+                transition_surf = pygame.Surface(self.display.get_size()) # change 30 to change the radius of the circle
+                pygame.draw.circle(transition_surf, (255, 255, 255), (self.display.get_width() // 2, self.display.get_height() // 2), (30 - abs(self.transition)) * 8) # change 3rd argument to change the place the circle is being drawn at
+                transition_surf.set_colorkey((255, 255, 255))
+                self.display.blit(transition_surf, (0, 0))
+
+        # Draw the second display onto the main one
+        if not self.underwater:
+            self.display_2.blit(self.display, (0,0))
+
+        # Rendering glowing particle effects
+        with self.profiler.zone('glow'):
+            for particle in self.glowing_particles:
+                # One cached sprite holds the core and all the halo rings, blitted centered on the particle
+                glow = self.glow_cache.get(particle[2], (150,150,150), (2,2,2))
+                if glow:
+                    self.display_2.blit(glow, ((int(particle[0][0] - render_scroll[0] - glow.get_width() / 2)), (int(particle[0][1] - render_scroll[1] - glow.get_height() / 2))), special_flags=pygame.BLEND_RGB_ADD)
+
+        # Factoring the screenshake into the camera offset, it has its own random generator so drawing or not drawing a frame never changes the game world
+        screenshake_offset = (self.render_random.random() * self.screenshake - self.screenshake / 2, self.render_random.random() * self.screenshake - self.screenshake / 2)
+
+        # Scaling up everything to the right size
+        with self.profiler.zone('scale'):
             self.screen.blit(pygame.transform.scale(self.display_2, self.screen.get_size()), screenshake_offset)
 
-            # Creating timer text and fonts
-            self.timer_font = pygame.font.SysFont('Times New Roman', 50)
-            self.timer_render = self.timer_font.render((str(self.timer[0]) if self.timer[0] >= 10 else '0' + str(self.timer[0])) + ':' + (str(self.timer[1]) if self.timer[1] >= 10 else '0' + str(self.timer[1])) + ':' + str(int(self.timer[2])), True, (255,255,255))
-            self.best_time_font = pygame.font.SysFont('Times New Roman', 20)
-            self.best_time_render = self.best_time_font.render('Best: ' + (str(self.best_time[0]) if self.best_time[0] >= 10 else '0' + str(self.best_time[0])) + ':' + (str(self.best_time[1]) if self.best_time[1] >= 10 else '0' + str(self.best_time[1])) + ':' + (str(int(self.best_time[2])) if self.best_time[2] >= 10 else '0' + str(self.best_time[2])), True, (255,255,255))
-            self.screen.blit(self.timer_render, (20, 20))
-            self.screen.blit(self.best_time_render, (20, 70))
-
-            # Updating the timer array
-            self.timer[2] += (5/3)
-            if int(self.timer[2]) == 100:
-                self.timer[1] += 1
-                self.timer[2] = 0
-            elif self.timer[1] == 60:
-                self.timer[0] += 1
-                self.timer[1] = 0
-
-            # Updating display, keep frame rate at 60
-            pygame.display.update()
-            self.clock.tick(60)
+        # Drawing the timer from cached digits and the best time, which is only rendered again when it changes
+        with self.profiler.zone('hud'):
+            self.timer_text.draw_glyphs(self.screen, format_time(self.timer), (20, 20))
+            self.best_time_text.draw(self.screen, self.best_time_label, (20, 70))
+
+        # Drawing the profiler overlay, it shows the frames before this one since this frame isn't done yet
+        if self.show_profiler:
+            self.profiler_overlay.render(self.screen)
+
+    # Method for running frames as fast as possible without the game loop, meant for the headless mode
+    # Drawing is optional, the game world ends up the same whether the frames are drawn or not
+    # Every frame is one step, so the timer counts game time instead of the time on the clock
+    def step(self, frames=1, render=False):
+        for i in range(frames):
+            self.profiler.begin_frame()
+            self.update()
+            self.advance_timer(STEP)
+            if render:
+                self.render()
+            self.profiler.end_frame()
+
+    # Method for running the game loop
+    def run(self):
+
+        # Switching music from main menu to game music, it was decoded while the menu was shown
+        self.asset_manager.require('music')
+        self.audio.add_sounds(self.asset_manager.groups['music'], self.asset_manager.manifest['music'])
+        self.audio.play_music('game', fade_ms=2000, fadeout_ms=500)
+        self.main_menu_music_playing = False
+
+        # Playing ambient sound effects
+        self.audio.play('ambience', loops=-1)
+
+        # Running the game loop
+        # The time since the last frame is saved up and spent on fixed steps, what is left over decides how far between two steps the frame is drawn
+        self.running = True
+        last_time = time.perf_counter()
+        saved_time = 0
+        while self.running:
+            self.profiler.begin_frame()
+
+            # The timer counts the real time on the clock
+            now = time.perf_counter()
+            self.advance_timer(now - last_time)
+            saved_time += now - last_time
+            last_time = now
+
+            # Handling events, keypresses
+            with self.profiler.zone('events'):
+                for event in pygame.event.get():
+                    self.handle_event(event)
+
+            if self.running:
+                steps = 0
+                while saved_time >= STEP and steps < MAX_STEPS:
+                    self.update()
+                    saved_time -= STEP
+                    steps += 1
+                if steps == MAX_STEPS:
+                    # Too far behind to catch up, let the game slow down instead of running even more steps next frame
+                    saved_time %= STEP
+                self.render(saved_time / STEP)
+
+                # Updating display
+                with self.profiler.zone('present'):
+                    pygame.display.update()
+
+                # The frame is done before waiting, so the waiting doesn't count as frame time
+                self.profiler.end_frame()
+
+                # Keep frame rate at most MAX_FPS
+                self.clock.tick(MAX_FPS)
+
+        # Escape was pressed, going back to the main menu
+        self.main_menu()
 
 # Calling the main_menu method from the game class
-Game().main_menu()
\ No newline at end of file
+if __name__ == '__main__':
+    Game().main_menu()
@@ -0,0 +1,229 @@
+import os
+import json
+import struct
+import threading
+
+import pygame
+
+from scripts.utils import BASE_IMG_PATH, Animation
+from scripts.atlas import Atlas, AtlasImage
+
+# Asset manager, loads the images and sounds listed in the manifest (data/assets.json) one group at a time
+#
+# Every manifest entry is one asset:
+#   {"image": path}              one image, paths are inside data/images/
+#   {"images": folder}           every image in a folder, in name order
+#   "atlas": true                the images are packed into the texture atlas of the group
+#   "flip": true                 the mirrored images are packed too (only for atlas images)
+#   "animation": [duration, loop] the images become an Animation
+#   {"sound": path, "volume": v}  a sound effect or song, decoded completely when it is loaded
+#   "priority", "voices"          how important a sound effect is and how often it can play at once, see scripts/audio.py
+#
+# Decoding hundreds of small pngs is most of the startup time, so the converted pixels of every group are saved in a bundle file in data/cache/
+# The bundle is used instead of the pngs as long as none of the image files and manifest entries of the group changed
+
+MANIFEST_PATH = 'data/assets.json'
+CACHE_PATH = 'data/cache/'
+BUNDLE_MAGIC = b'QQAB'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sHI') # magic, version, length of the json part
+
+# Returns the image files of a manifest entry, relative to data/images/
+def image_files(entry):
+    if 'image' in entry:
+        return [entry['image']]
+    return [entry['images'] + '/' + img_name for img_name in sorted(os.listdir(BASE_IMG_PATH + entry['images']))]
+
+# Returns which image the entry is made of, entries with the same images share them (like the collectables tiles and particles)
+def image_key(entry):
+    return '%s|%d|%d' % (entry.get('image', entry.get('images')), entry.get('atlas', False), entry.get('flip', False))
+
+class AssetManager:
+    def __init__(self, manifest_path=MANIFEST_PATH, cache_path=CACHE_PATH):
+        f = open(manifest_path, 'r')
+        self.manifest = json.load(f)
+        f.close()
+        self.cache_path = cache_path
+        self.groups = {group: {} for group in self.manifest} # group -> {name: asset}, the dicts are filled in when the group is loaded, so they can be handed out before that
+        self.assets = {} # every loaded asset of every group by name
+        self.loaded = set()
+        self.read_groups = {} # group -> what the background thread read, waiting to be finished on the main thread
+        self.thread = None
+        self.error = None # exception of the background thread, raised again when the group is needed
+
+    # Starts reading groups from the disk in a background thread, require finishes them
+    # Only reading and decoding happens in the thread, converting to the display format and packing is done on the main thread
+    def load_async(self, *groups):
+        self.wait()
+        groups = [group for group in groups if group not in self.loaded and group not in self.read_groups]
+        if groups:
+            self.thread = threading.Thread(target=self.read_all, args=(groups,), daemon=True)
+            self.thread.start()
+
+    def read_all(self, groups):
+        try:
+            for group in groups:
+                self.read_groups[group] = self.read(group)
+        except Exception as e:
+            self.error = e
+
+    # True if a group can be loaded without waiting for the disk
+    def ready(self, group):
+        return group in self.loaded or group in self.read_groups
+
+    # Waits for the background thread to be done
+    def wait(self):
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.error:
+            error = self.error
+            self.error = None
+            raise error
+
+    # Makes sure the groups are loaded, waits for the background thread if it is still reading them
+    def require(self, *groups):
+        for group in groups:
+            if group in self.loaded:
+                continue
+            if group not in self.read_groups:
+                self.wait()
+            if group not in self.read_groups:
+                self.read_groups[group] = self.read(group)
+            self.finish(group, self.read_groups.pop(group))
+
+    # Path, modified time and size of every image of a group, the bundle is only used if this is the same as when it was made
+    def sources(self, group):
+        sources = []
+        for entry in self.manifest[group].values():
+            if 'sound' not in entry:
+                for path in image_files(entry):
+                    stat = os.stat(BASE_IMG_PATH + path)
+                    sources.append([path, stat.st_mtime_ns, stat.st_size])
+        return sources
+
+    # Reads a group from the disk, returns (bundle header, bundle pixels, sounds) if the bundle is up to date, or (None, {path: decoded image}, sounds)
+    # This is the part that can run in a background thread
+    def read(self, group):
+        entries = self.manifest[group]
+        sounds = {name: pygame.mixer.Sound(entry['sound']) for name, entry in entries.items() if 'sound' in entry}
+        sources = self.sources(group)
+        if not sources:
+            return None, {}, sounds
+
+        bundle = self.read_bundle(group)
+        if bundle and bundle[0]['sources'] == sources and bundle[0]['manifest'] == entries:
+            return bundle[0], bundle[1], sounds
+
+        images = {}
+        for path, mtime, size in sources:
+            if path not in images:
+                images[path] = pygame.image.load(BASE_IMG_PATH + path)
+        return None, images, sounds
+
+    # Reads the bundle file of a group, returns (header, pixels) or None if there is no usable bundle
+    def read_bundle(self, group):
+        path = self.cache_path + group + '.bundle'
+        if not os.path.exists(path):
+            return None
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        if len(data) < BUNDLE_HEADER.size:
+            return None
+        magic, version, header_size = BUNDLE_HEADER.unpack_from(data, 0)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            return None
+        header = json.loads(data[BUNDLE_HEADER.size:BUNDLE_HEADER.size + header_size].decode('utf-8'))
+        return header, memoryview(data)[BUNDLE_HEADER.size + header_size:]
+
+    # Turns what read returned into the assets of the group, on the main thread since converting needs the display
+    def finish(self, group, read_result):
+        header, pixels, sounds = read_result
+        entries = self.manifest[group]
+        if header:
+            images = self.images_from_bundle(header, pixels)
+        else:
+            images = self.images_from_files(group, entries, pixels)
+
+        assets = self.groups[group]
+        for name, entry in entries.items():
+            if 'sound' in entry:
+                sounds[name].set_volume(entry.get('volume', 1))
+                assets[name] = sounds[name]
+                continue
+            asset = images[image_key(entry)]
+            if 'image' in entry:
+                asset = asset[0]
+            elif 'animation' in entry:
+                asset = Animation(asset, img_dur=entry['animation'][0], loop=entry['animation'][1])
+            assets[name] = asset
+        self.assets.update(assets)
+        self.loaded.add(group)
+
+    # Converts and packs the decoded images of a group and saves them as a bundle for the next start
+    def images_from_files(self, group, entries, decoded):
+        atlas = Atlas()
+        images = {} # image key -> list of atlas images or surfaces
+        for entry in entries.values():
+            if 'sound' in entry or image_key(entry) in images:
+                continue
+            surfs = [decoded[path].convert() for path in image_files(entry)]
+            if entry.get('atlas'):
+                images[image_key(entry)] = [atlas.add(surf, entry.get('flip', False)) for surf in surfs]
+            else:
+                for surf in surfs:
+                    surf.set_colorkey((0, 0, 0))
+                images[image_key(entry)] = surfs
+        atlas.pack()
+        if images:
+            self.write_bundle(group, entries, atlas, images)
+        return images
+
+    # Writes the bundle of a group, the atlas pages and the images that are not in the atlas are saved as raw RGB pixels
+    # Black is the see-through color of every image, so the pixels need no alpha
+    def write_bundle(self, group, entries, atlas, images):
+        pages = list(atlas.pages)
+        layout = {}
+        for key, imgs in images.items():
+            layout[key] = []
+            for img in imgs:
+                if isinstance(img, AtlasImage):
+                    item = [pages.index(img.page), img.rect.x, img.rect.y, img.width, img.height]
+                    if img.flipped is not None:
+                        item += [pages.index(img.flipped.page), img.flipped.rect.x, img.flipped.rect.y]
+                else:
+                    item = [len(pages)]
+                    pages.append(img)
+                layout[key].append(item)
+        header = json.dumps({'sources': self.sources(group), 'manifest': entries, 'pages': [list(page.get_size()) for page in pages], 'images': layout}).encode('utf-8')
+        try:
+            os.makedirs(self.cache_path, exist_ok=True)
+            f = open(self.cache_path + group + '.bundle', 'wb')
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header)) + header + b''.join(pygame.image.tobytes(page, 'RGB') for page in pages))
+            f.close()
+        except OSError: # the bundle only makes the next start faster, the game works without it
+            pass
+
+    # Makes the images of a group from the pixels in its bundle, one surface per page instead of one per image
+    def images_from_bundle(self, header, pixels):
+        atlas = Atlas()
+        pages = []
+        offset = 0
+        for width, height in header['pages']:
+            size = width * height * 3
+            pages.append(atlas.add_page(pygame.image.frombytes(bytes(pixels[offset:offset + size]), (width, height), 'RGB').convert()))
+            offset += size
+        images = {}
+        for key, items in header['images'].items():
+            images[key] = []
+            for item in items:
+                if len(item) == 1: # an image that is not in the atlas
+                    images[key].append(pages[item[0]])
+                    continue
+                img = AtlasImage(page=pages[item[0]], rect=pygame.Rect(item[1:5]))
+                if len(item) > 5:
+                    img.flipped = AtlasImage(page=pages[item[5]], rect=pygame.Rect(item[6], item[7], item[3], item[4]))
+                    img.flipped.flipped = img
+                images[key].append(img)
+        return images
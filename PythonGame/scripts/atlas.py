@@ -0,0 +1,104 @@
+import pygame
+
+# Size of one atlas page, images that are bigger than a page get a page of their own
+PAGE_SIZE = 512
+
+# Atlas image class, a handle to one image inside an atlas page
+# Draw it with surf.blit(img.page, pos, img.rect), the page is only known after the atlas is packed
+# Images from an asset bundle are made with the page and rect they already had, they don't need packing
+class AtlasImage:
+    def __init__(self, surf=None, page=None, rect=None):
+        self.source = surf # the loaded image, only kept until the atlas is packed
+        self.page = page
+        self.rect = rect
+        self.width, self.height = surf.get_size() if surf is not None else rect.size
+        self.flipped = None # handle to the mirrored image, only for the images that were loaded with flip=True
+        self.surf = None # stand-alone copy of the image, only made for the things that need a real surface
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_size(self):
+        return (self.width, self.height)
+
+    # Returns the image as its own surface, used for making outlines and editor previews, made once when first asked for
+    def surface(self):
+        if self.surf is None:
+            self.surf = pygame.Surface(self.get_size())
+            self.surf.blit(self.page, (0, 0), self.rect)
+            self.surf.set_colorkey((0, 0, 0))
+        return self.surf
+
+# Texture atlas class, packs many small images into a few big surfaces
+# Images are added while the assets are loaded and get their place in a page when pack is called
+class Atlas:
+    def __init__(self, page_size=PAGE_SIZE):
+        self.page_size = page_size
+        self.pages = []
+        self.images = [] # every handle, in the order they were added
+
+    # Adds an image to the atlas and returns its handle, flip also packs the mirrored image for sprites that can face both ways
+    def add(self, surf, flip=False):
+        img = AtlasImage(surf)
+        self.images.append(img)
+        if flip:
+            img.flipped = AtlasImage(pygame.transform.flip(surf, True, False))
+            img.flipped.flipped = img
+            self.images.append(img.flipped)
+        return img
+
+    # Adds a page that was packed before, like one read from an asset bundle
+    def add_page(self, surf):
+        surf.set_colorkey((0, 0, 0))
+        self.pages.append(surf)
+        return surf
+
+    # Puts every image that wasn't packed yet into the pages, in rows (shelves) from the tallest image to the shortest
+    # The pages are converted to the display format with black as the see-through color, just like the single images were
+    def pack(self):
+        todo = sorted([img for img in self.images if img.page is None], key=lambda img: (-img.height, -img.width))
+        if not todo:
+            return
+        placed = [] # (page index, image, position)
+        shelves = [] # [page index, y, height, x of the free space] of every shelf
+        page_heights = [] # used height of every new page
+        for img in todo:
+            if img.width > self.page_size or img.height > self.page_size:
+                page_heights.append(None) # the image is the whole page
+                placed.append((len(page_heights) - 1, img, (0, 0)))
+                continue
+            for shelf in shelves:
+                if img.height <= shelf[2] and shelf[3] + img.width <= self.page_size:
+                    break
+            else:
+                for page in range(len(page_heights)):
+                    if page_heights[page] is not None and page_heights[page] + img.height <= self.page_size:
+                        break
+                else:
+                    page_heights.append(0)
+                    page = len(page_heights) - 1
+                shelf = [page, page_heights[page], img.height, 0]
+                page_heights[page] += img.height
+                shelves.append(shelf)
+            placed.append((shelf[0], img, (shelf[3], shelf[1])))
+            shelf[3] += img.width
+
+        # Only as big as the used part of the page, small atlases don't need a whole page
+        widths = [0] * len(page_heights)
+        for page, img, pos in placed:
+            widths[page] = max(widths[page], pos[0] + img.width)
+        first = len(self.pages)
+        for page, height in enumerate(page_heights):
+            size = (widths[page], height if height is not None else max(img.height for p, img, pos in placed if p == page))
+            surf = pygame.Surface(size).convert()
+            surf.fill((0, 0, 0))
+            surf.set_colorkey((0, 0, 0))
+            self.pages.append(surf)
+        for page, img, pos in placed:
+            img.page = self.pages[first + page]
+            img.rect = pygame.Rect(pos, img.get_size())
+            img.page.blit(img.source, pos)
+            img.source = None
@@ -0,0 +1,98 @@
+import math
+
+import pygame
+
+# Channels of the mixer, the first MUSIC_CHANNELS are only used for music so sound effects can never take them
+CHANNELS = 16
+MUSIC_CHANNELS = 2 # two so a new song can fade in while the old one fades out
+DEFAULT_PRIORITY = 1
+DEFAULT_VOICES = 4 # how many times one sound can play at the same time
+HEARING_DISTANCE = 160 # pixels outside the camera view a sound can still be heard from, it gets quieter the further away it is
+
+# Audio engine class, every sound effect and song is played through it
+# Sound effects get a channel from a fixed pool, so the cost of playing sounds stays the same no matter how many enemies are shooting
+class AudioEngine:
+    def __init__(self, channels=CHANNELS):
+        pygame.mixer.set_num_channels(channels)
+        pygame.mixer.set_reserved(MUSIC_CHANNELS)
+        self.music_channels = [pygame.mixer.Channel(i) for i in range(MUSIC_CHANNELS)]
+        self.music_index = 0 # the music channel the current song is on
+        self.music = None # name of the song that is playing
+        self.channels = [pygame.mixer.Channel(i) for i in range(MUSIC_CHANNELS, channels)]
+        self.voices = [None] * len(self.channels) # (sound name, priority, play number) of what every channel was last given
+        self.sounds = {} # name -> (Sound, priority, voice limit)
+        self.view = None # the part of the world the camera sees, sounds from far outside it are not played
+        self.played = 0 # sounds played so far, used to find the oldest voice
+        self.culled = 0 # sounds not played because they were too far away
+        self.dropped = 0 # sounds not played because every channel had something more important
+
+    # Adds sounds, with the priority and voice limit from their manifest entries
+    def add_sounds(self, sounds, entries):
+        for name, sound in sounds.items():
+            self.sounds[name] = (sound, entries[name].get('priority', DEFAULT_PRIORITY), entries[name].get('voices', DEFAULT_VOICES))
+
+    # How loud (0 - 1) a sound at a world position is, 1 inside the camera view and less the further outside it is
+    def audibility(self, pos):
+        if self.view is None:
+            return 1
+        dx = max(self.view.left - pos[0], 0, pos[0] - self.view.right)
+        dy = max(self.view.top - pos[1], 0, pos[1] - self.view.bottom)
+        return 1 - math.sqrt(dx * dx + dy * dy) / HEARING_DISTANCE
+
+    # Plays a sound effect, pos is where in the world it comes from, sounds without a pos are always heard
+    # Returns the channel it is playing on, or None if it was culled or every channel had something more important
+    def play(self, name, pos=None, loops=0):
+        sound, priority, voice_limit = self.sounds[name]
+        volume = 1
+        if pos is not None:
+            volume = self.audibility(pos)
+            if volume <= 0:
+                self.culled += 1
+                return None
+
+        busy = [channel.get_busy() for channel in self.channels]
+        same = [i for i, voice in enumerate(self.voices) if busy[i] and voice[0] == name]
+        if len(same) >= voice_limit:
+            # The sound is already playing as often as it may, its oldest voice starts over
+            index = min(same, key=lambda i: self.voices[i][2])
+        elif False in busy:
+            index = busy.index(False)
+        else:
+            # Every channel is busy, the least important and oldest voice is stopped if it isn't more important than this one
+            index = min(range(len(self.channels)), key=lambda i: (self.voices[i][1], self.voices[i][2]))
+            if self.voices[index][1] > priority:
+                self.dropped += 1
+                return None
+
+        self.played += 1
+        channel = self.channels[index]
+        channel.play(sound, loops=loops)
+        channel.set_volume(volume)
+        self.voices[index] = (name, priority, self.played)
+        return channel
+
+    # Stops every voice of a sound, like the looping ambience
+    def stop(self, name):
+        for i, voice in enumerate(self.voices):
+            if voice and voice[0] == name:
+                self.channels[i].stop()
+                self.voices[i] = None
+
+    # Starts a song, the old song fades out on its own channel while the new one fades in
+    # Songs are sounds that were decoded in the background when they were loaded, so nothing is read from the disk here
+    def play_music(self, name, fade_ms=0, fadeout_ms=0):
+        if name == self.music:
+            return
+        if self.music:
+            if fadeout_ms:
+                self.music_channels[self.music_index].fadeout(fadeout_ms)
+            else:
+                self.music_channels[self.music_index].stop()
+            self.music_index = (self.music_index + 1) % MUSIC_CHANNELS
+        self.music_channels[self.music_index].play(self.sounds[name][0], loops=-1, fade_ms=fade_ms)
+        self.music = name
+
+    def stop_music(self):
+        for channel in self.music_channels:
+            channel.stop()
+        self.music = None
@@ -0,0 +1,92 @@
+import os
+import mmap
+
+from scripts import mapfile
+
+# Chunk stream class, used as the chunk dict of the tilemap for levels that are too big to keep in memory
+# The .map file is memory mapped, a chunk is only read from it when something asks for it, and chunks that haven't been needed for a while are thrown away again
+class ChunkStream(dict):
+    # Initialize the stream, budget is how many chunks are kept in memory at most (chunks that are needed right now are never thrown away)
+    def __init__(self, tilemap, path, budget=256, prefetch_per_frame=8):
+        super().__init__()
+        self.tilemap = tilemap
+        self.path = path
+        self.modified = os.path.getmtime(path)
+        f = open(path, 'rb')
+        self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        self.file = mapfile.MapFile(self.mmap)
+        self.index = {key: i for i, key in enumerate(self.file.chunk_keys)} # (chunk x, chunk y) -> index in the file
+        self.type_ids = [tilemap.type_id(tile_type) for tile_type in self.file.tile_types] # file type index -> tilemap type id
+        self.budget = budget
+        self.prefetch_per_frame = prefetch_per_frame # chunks read ahead per frame at most, so reading ahead never makes a frame slow
+        self.changed = set() # chunks that were changed since the level was loaded, they are never thrown away since the file has the old version
+        self.last_used = {} # (chunk x, chunk y) -> the frame the chunk was last needed
+        self.frame = 0
+        self.reads = 0 # chunks read from the file, for the profiler and benchmarks
+
+    # Forgets every chunk, used when the same level is loaded again
+    def reset(self):
+        self.clear()
+        self.changed.clear()
+        self.last_used.clear()
+
+    def close(self):
+        self.clear()
+        self.mmap.close()
+
+    # Same as dict.get, but chunks that are in the file and not in memory are read first
+    def get(self, key, default=None):
+        chunk = dict.get(self, key)
+        if chunk is None:
+            if key in self.index and key not in self.changed:
+                return self.read(key)
+            return default
+        return chunk
+
+    # Reads a chunk from the file into memory
+    def read(self, key):
+        chunk = self.tilemap.make_chunk(self.file, self.index[key], self.type_ids)
+        self[key] = chunk
+        self.last_used[key] = self.frame
+        self.reads += 1
+        return chunk
+
+    # Returns the keys of every chunk in the level, in memory or not, tile_types only gives the chunks that have one of those types in the file
+    def level_keys(self, tile_types=None):
+        keys = set(dict.keys(self))
+        mask = None
+        if tile_types is not None:
+            mask = 0
+            for i, tile_type in enumerate(self.file.tile_types):
+                if tile_type in tile_types:
+                    mask |= 1 << i
+        for key, i in self.index.items():
+            if key not in self.changed and (mask is None or self.file.type_masks[i] & mask):
+                keys.add(key)
+        return sorted(keys)
+
+    # Called once per frame with the chunks that are needed now and the chunks that will probably be needed soon
+    # Reads the needed chunks, reads some of the upcoming ones and throws away the chunks that were needed the longest time ago when there are too many
+    def update(self, needed, upcoming):
+        self.frame += 1
+        for key in needed:
+            if dict.__contains__(self, key):
+                self.last_used[key] = self.frame
+            elif key in self.index and key not in self.changed:
+                self.read(key)
+
+        reads = 0
+        for key in upcoming:
+            if dict.__contains__(self, key):
+                self.last_used[key] = self.frame
+            elif reads < self.prefetch_per_frame and key in self.index and key not in self.changed:
+                self.read(key)
+                reads += 1
+
+        if len(self) > self.budget:
+            old = sorted((self.last_used.get(key, 0), key) for key in self if key not in self.changed and self.last_used.get(key, 0) < self.frame)
+            for frame, key in old[:len(self) - self.budget]:
+                del self[key]
+                del self.last_used[key]
+                self.tilemap.forget_chunk_surfs(key)
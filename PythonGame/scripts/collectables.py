@@ -0,0 +1,64 @@
+import pygame
+
+# Size of the hitbox of a gem, its top left corner is where the gem was placed
+COLLECTABLE_SIZE = (13, 13)
+
+# Collectable registry class, the gems of the current level indexed by the grid cells they overlap
+# Only the player picks gems up, it looks in the cells its rect overlaps instead of checking every gem
+# All gems share one animation, they are placed at the same time when the level loads so they were always in step anyway
+class CollectableRegistry:
+    def __init__(self, game, tile_size=16):
+        self.game = game
+        self.tile_size = tile_size
+        self.rects = [] # rect of every gem that is left, in level order
+        self.cells = {} # (cell x, cell y) -> the rects of the gems overlapping that cell
+        self.acquired = set() # (level file, x, y) of every gem that was picked up, kept between levels
+        self.level = None
+        self.frame = 0
+
+    # The cells a rect overlaps
+    def cell_keys(self, rect):
+        size = self.tile_size
+        return [(cx, cy) for cx in range(rect.left // size, (rect.right - 1) // size + 1) for cy in range(rect.top // size, (rect.bottom - 1) // size + 1)]
+
+    # Puts the gems of a level in the registry, level is what the acquired gems are remembered by
+    def load(self, level, positions):
+        self.level = level
+        self.rects = []
+        self.cells = {}
+        self.frame = 0
+        for pos in positions:
+            rect = pygame.Rect(pos, COLLECTABLE_SIZE)
+            self.rects.append(rect)
+            for key in self.cell_keys(rect):
+                self.cells.setdefault(key, []).append(rect)
+
+    def __len__(self):
+        return len(self.rects)
+
+    # Picks up every gem touching a rect, returns how many were picked up
+    def collect(self, rect):
+        found = []
+        for key in self.cell_keys(rect):
+            for gem in self.cells.get(key, ()):
+                if gem not in found and rect.colliderect(gem):
+                    found.append(gem)
+        for gem in found:
+            self.rects.remove(gem)
+            for key in self.cell_keys(gem):
+                self.cells[key].remove(gem)
+                if not self.cells[key]:
+                    del self.cells[key]
+            self.acquired.add((self.level, gem.x, gem.y))
+        return len(found)
+
+    # Moves the shared animation one frame
+    def update(self):
+        animation = self.game.assets['particle/collectables']
+        self.frame = (self.frame + 1) % (animation.img_duration * len(animation.images))
+
+    # Draws every gem, they are atlas images drawn from their top left corner
+    def render(self, surf, offset=(0, 0)):
+        animation = self.game.assets['particle/collectables']
+        img = animation.images[int(self.frame / animation.img_duration)]
+        surf.blits([(img.page, (gem.x - offset[0], gem.y - offset[1]), img.rect) for gem in self.rects], doreturn=False)
@@ -3,8 +3,6 @@ import random
 
 import pygame
 
-from scripts.particle import Particle
-from scripts.spark import Spark
 
 class PhysicsEntity:
     # Initialize a physics entity with game reference, type, position, and size
@@ -12,6 +10,7 @@ class PhysicsEntity:
         self.game = game
         self.type = e_type
         self.pos = list(pos)
+        self.prev_pos = list(pos) # Position before the last update, used to draw the entity between two updates
         self.size = size
         self.velocity = [0, 0] # Initial velocity
         self.collisions = {'up': False, 'down': False, 'right': False, 'left': False} # Collision flags
@@ -23,6 +22,9 @@ class PhysicsEntity:
 
         self.last_movement = [0, 0] # Last movement direction
 
+        # Add entity to the spatial hash of the game, it is moved in there every update
+        self.game.entity_hash.insert(self, self.rect())
+
     def rect(self):
         # Returns a pygame.Rect object representing entity's position and size
         return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
@@ -34,83 +36,81 @@ class PhysicsEntity:
             # Copy animation from game assets
             self.animation = self.game.assets[self.type + '/' + self.action].copy()
 
+    # Forget where the entity was, used when it is moved without walking there, like when respawning
+    def snap(self):
+        self.prev_pos = list(self.pos)
+
+    # Position to draw the entity at, alpha is how far (0 - 1) the game is between the last update and the next one
+    def render_pos(self, alpha=1):
+        return (self.prev_pos[0] + (self.pos[0] - self.prev_pos[0]) * alpha, self.prev_pos[1] + (self.pos[1] - self.prev_pos[1]) * alpha)
+
     def update(self, tilemap, movement=(0, 0)):
+        self.prev_pos[0] = self.pos[0]
+        self.prev_pos[1] = self.pos[1]
+
         # Update collisions dictionary
         self.collisions = {'up': False, 'down': False, 'right': False, 'left': False}
 
-        frame_movement = (movement[0] + self.velocity[0], movement[1] + self.velocity[1])
-
-        # Horizontal collisions
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for index, types in enumerate(tilemap.physics_rects_around(self.pos)):
-            for rect in types:
-                if entity_rect.colliderect(rect):
-                    if frame_movement[0] > 0:
-                        entity_rect.right = rect.left
-                        self.collisions['right'] = True
-                        if index == 2 and self.type == 'player':
-                            # Player collision with a certain type, increment dead count
-                            self.game.dead += 1
-                    if frame_movement[0] < 0:
-                        entity_rect.left = rect.right
-                        self.collisions['left'] = True
-                        if index == 2 and self.type == 'player':
-                            # Player collision with a certain type, increment dead count
-                            self.game.dead += 1
-                    self.pos[0] = entity_rect.x
+        # Moving and colliding with the tiles, timed as its own profiler zone since it is inside the enemies and player zones
+        with self.game.profiler.zone('physics'):
+            frame_movement = (movement[0] + self.velocity[0], movement[1] + self.velocity[1])
+
+            # Horizontal collisions
+            self.pos[0] += frame_movement[0]
+            entity_rect = self.rect()
+            collisions = tilemap.physics_rects_around(entity_rect)
+            for index, types in enumerate(collisions.layers):
+                for rect in types:
+                    if entity_rect.colliderect(rect):
+                        if frame_movement[0] > 0:
+                            entity_rect.right = rect.left
+                            self.collisions['right'] = True
+                            if index == 2 and self.type == 'player':
+                                # Player collision with a certain type, increment dead count
+                                self.game.dead += 1
+                        if frame_movement[0] < 0:
+                            entity_rect.left = rect.right
+                            self.collisions['left'] = True
+                            if index == 2 and self.type == 'player':
+                                # Player collision with a certain type, increment dead count
+                                self.game.dead += 1
+                        self.pos[0] = entity_rect.x
         
-        # Handle checkpoints collision
-        entity_rect = self.rect()
-        for tile in tilemap.tiles_around(self.pos):
-            if tile['type'] == 'checkpoints' and tile['variant'] == 0:
-                rect = pygame.Rect(tile['pos'][0] * tilemap.tile_size, tile['pos'][1] * tilemap.tile_size, tilemap.tile_size, tilemap.tile_size)
+            # Handle checkpoints collision, the unclaimed checkpoints come from the same query as the horizontal collisions
+            entity_rect = self.rect()
+            for rect, cell in zip(collisions.checkpoints, collisions.checkpoint_cells):
                 if entity_rect.colliderect(rect):
                     # Update checkpoint states
-                    tile_loc = str(tile['pos'][0]) + str(';') + str(tile['pos'][1])
-                    del tilemap.tilemap[tile_loc]
-                    tilemap.tilemap[tile_loc] = {'type': 'checkpoints', 'variant': 1, 'pos': tile['pos']}
-                    if self.game.checkpoint_claimed != [0, 0] and self.game.checkpoint_claimed != tile['pos']:
-                        del tilemap.tilemap[str(self.game.checkpoint_claimed[0]) + str(';') + str(self.game.checkpoint_claimed[1])]
-                        tilemap.tilemap[str(self.game.checkpoint_claimed[0]) + str(';') + str(self.game.checkpoint_claimed[1])] = {'type': 'checkpoints', 'variant': 0, 'pos': self.game.checkpoint_claimed}
-                        self.game.checkpoint_claimed = tile['pos']
+                    tilemap.set_tile(cell, 'checkpoints', 1)
+                    if self.game.checkpoint_claimed != [0, 0] and self.game.checkpoint_claimed != list(cell):
+                        tilemap.set_tile(self.game.checkpoint_claimed, 'checkpoints', 0)
+                        self.game.checkpoint_claimed = list(cell)
                     else:
-                        self.game.checkpoint_claimed = tile['pos']
-
-        # Handle collectibles collision
-        entity_rect = self.rect()
-        for collectable in self.game.collectables:
-            if entity_rect.colliderect(collectable):
-                for particle in self.game.particles.copy():
-                    if particle.pos == [collectable.x, collectable.y]:
-                        self.game.particles.remove(particle)
-                        self.game.collectables.remove(collectable)
-                        is_collectable_aquired = False
-                        for rect in self.game.collectables_aquired:
-                            if rect == collectable:
-                                is_collectable_aquired = True
-                        if not is_collectable_aquired:
-                            self.game.collectables_aquired += [collectable]
-
-        # Vertical collisions
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for index, types in enumerate(tilemap.physics_rects_around(self.pos)):
-            for rect in types:
-                if entity_rect.colliderect(rect):
-                    if frame_movement[1] > 0:
-                        entity_rect.bottom = rect.top
-                        self.collisions['down'] = True
-                        if index == 1 and self.type == 'player':
-                            # Player collision with a certain type, increment dead count
-                            self.game.dead += 1
-                    if frame_movement[1] < 0:
-                        entity_rect.top = rect.bottom
-                        self.collisions['up'] = True
-                        if index == 1 and self.type == 'player':
-                            # Player collision with a certain type, increment dead count
-                            self.game.dead += 1
-                    self.pos[1] = entity_rect.y
+                        self.game.checkpoint_claimed = list(cell)
+
+            # Handle collectibles collision, only the player picks them up
+            if self.type == 'player':
+                self.game.collectables.collect(self.rect())
+
+            # Vertical collisions
+            self.pos[1] += frame_movement[1]
+            entity_rect = self.rect()
+            for index, types in enumerate(tilemap.physics_rects_around(entity_rect).layers):
+                for rect in types:
+                    if entity_rect.colliderect(rect):
+                        if frame_movement[1] > 0:
+                            entity_rect.bottom = rect.top
+                            self.collisions['down'] = True
+                            if index == 1 and self.type == 'player':
+                                # Player collision with a certain type, increment dead count
+                                self.game.dead += 1
+                        if frame_movement[1] < 0:
+                            entity_rect.top = rect.bottom
+                            self.collisions['up'] = True
+                            if index == 1 and self.type == 'player':
+                                # Player collision with a certain type, increment dead count
+                                self.game.dead += 1
+                        self.pos[1] = entity_rect.y
 
         # Update flip flag based on movement direction
         if movement[0] > 0:
@@ -130,9 +130,20 @@ class PhysicsEntity:
         # Update animation
         self.animation.update()
 
-    def render(self, surf, offset=(0, 0)):
-        # Render entity on provided surface
-        surf.blit(pygame.transform.flip(self.animation.img(), self.flip, False), (self.pos[0] - offset[0] + self.anim_offset[0], self.pos[1] - offset[1] + self.anim_offset[1]))
+        # Update place in the spatial hash
+        self.game.entity_hash.move(self, self.rect())
+
+    def render(self, surf, offset=(0, 0), alpha=1, outline=None):
+        # Render entity on provided surface, in between its last two positions, and its outline if there is an outline layer
+        # The frames are atlas images with their mirrored version packed next to them, so nothing is flipped while drawing
+        pos = self.render_pos(alpha)
+        img = self.animation.img()
+        if self.flip:
+            img = img.flipped
+        img_pos = (pos[0] - offset[0] + self.anim_offset[0], pos[1] - offset[1] + self.anim_offset[1])
+        surf.blit(img.page, img_pos, img.rect)
+        if outline:
+            outline.draw(img, img_pos)
 
 
 class Enemy(PhysicsEntity):
@@ -159,15 +170,17 @@ class Enemy(PhysicsEntity):
                 if (abs(dis[1]) < 16):
                     # Shoot projectile towards player
                     if (self.flip and dis[0] < 0):
-                        self.game.sfx['shoot'].play()
-                        self.game.projectiles.append([[self.rect().centerx - 7, self.rect().centery], -1.5, 0])
+                        self.game.audio.play('shoot', self.rect().center)
+                        pos = (self.rect().centerx - 7, self.rect().centery)
+                        self.game.projectiles.spawn(pos, -1.5)
                         for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1][0], random.random() - 0.5 + math.pi, 2 + random.random()))
+                            self.game.sparks.spawn(pos, random.random() - 0.5 + math.pi, 2 + random.random())
                     if (not self.flip and dis[0] > 0):
-                        self.game.sfx['shoot'].play()
-                        self.game.projectiles.append([[self.rect().centerx + 7, self.rect().centery], 1.5, 0])
+                        self.game.audio.play('shoot', self.rect().center)
+                        pos = (self.rect().centerx + 7, self.rect().centery)
+                        self.game.projectiles.spawn(pos, 1.5)
                         for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1][0], random.random() - 0.5, 2 + random.random()))
+                            self.game.sparks.spawn(pos, random.random() - 0.5, 2 + random.random())
                         
         elif random.random() < 0.01:
             self.walking = random.randint(30, 120)
@@ -180,31 +193,38 @@ class Enemy(PhysicsEntity):
         else:
             self.set_action('idle')
 
-        # Handle player dash collision
-        if abs(self.game.player.dashing) >= 50:
+        # Handle player dash collision, only the enemies the game found near the player can be hit
+        if abs(self.game.player.dashing) >= 50 and id(self) in self.game.dash_targets:
             if self.rect().colliderect(self.game.player.rect()):
                 # Trigger effects on collision
                 self.game.screenshake = max(16, self.game.screenshake)
-                self.game.sfx['hit'].play()
+                self.game.audio.play('hit', self.rect().center)
                 for i in range(30):
                     angle = random.random() * math.pi * 2
                     speed = random.random() * 5
-                    self.game.sparks.append(Spark(self.rect().center, angle, 2 + random.random()))
-                    self.game.particles.append(Particle(self.game, 'particle', self.rect().center, velocity=[math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], frame=random.randint(0, 7)))
-                self.game.sparks.append(Spark(self.rect().center, 0, 5 + random.random()))
-                self.game.sparks.append(Spark(self.rect().center, math.pi, 5 + random.random()))
+                    self.game.sparks.spawn(self.rect().center, angle, 2 + random.random())
+                    self.game.particles.spawn('particle', self.rect().center, velocity=[math.cos(angle + math.pi) * speed * 0.5, math.sin(angle + math.pi) * speed * 0.5], frame=random.randint(0, 7))
+                self.game.sparks.spawn(self.rect().center, 0, 5 + random.random())
+                self.game.sparks.spawn(self.rect().center, math.pi, 5 + random.random())
                 return True
 
-    def render(self, surf, offset=(0,0)):
+    def render(self, surf, offset=(0,0), alpha=1, outline=None):
         # Render enemy and its weapon on provided surface
-        super().render(surf, offset=offset)
+        super().render(surf, offset=offset, alpha=alpha, outline=outline)
 
+        rect = pygame.Rect(self.render_pos(alpha), self.size)
+        gun = self.game.assets['gun']
         if self.flip:
             # Render weapon flipped
-            surf.blit(pygame.transform.flip(self.game.assets['gun'], True, False), (self.rect().centerx - 4 - self.game.assets['gun'].get_width() - offset[0], self.rect().centery - offset[1]))
+            gun_pos = (rect.centerx - 4 - gun.get_width() - offset[0], rect.centery - offset[1])
         else:
             # Render weapon
-            surf.blit(self.game.assets['gun'], (self.rect().centerx + 4 - offset[0], self.rect().centery - offset[1]))
+            gun_pos = (rect.centerx + 4 - offset[0], rect.centery - offset[1])
+        if self.flip:
+            gun = gun.flipped
+        surf.blit(gun.page, gun_pos, gun.rect)
+        if outline:
+            outline.draw(gun, gun_pos)
 
 
 class Player(PhysicsEntity):
@@ -262,7 +282,7 @@ class Player(PhysicsEntity):
                 angle = random.random() * math.pi * 2
                 speed = random.random() * 0.5 + 0.5
                 pvelocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                self.game.particles.append(Particle(self.game, 'particle', self.rect().center, velocity=pvelocity, frame=random.randint(0, 7)))
+                self.game.particles.spawn('particle', self.rect().center, velocity=pvelocity, frame=random.randint(0, 7))
         if self.dashing > 0:
             self.dashing = max(0, self.dashing - 1)
         if self.dashing < 0:
@@ -273,7 +293,7 @@ class Player(PhysicsEntity):
             if abs(self.dashing) == 51:
                 self.velocity[0] *= 0.1
             pvelocity = [abs(self.dashing) / self.dashing * random.random() * 3, 0]
-            self.game.particles.append(Particle(self.game, 'particle', self.rect().center, velocity=pvelocity, frame=random.randint(0, 7)))
+            self.game.particles.spawn('particle', self.rect().center, velocity=pvelocity, frame=random.randint(0, 7))
         
         # Slow down horizontal movement
         if self.velocity[0] > 0:
@@ -282,9 +302,9 @@ class Player(PhysicsEntity):
             self.velocity[0] = min(self.velocity[0] + 0.05, 0) # origanally +0.1
 
     # Render the player, mostly from the physicsentety renderer
-    def render(self, surf, offset=(0, 0)):
+    def render(self, surf, offset=(0, 0), alpha=1, outline=None):
         if abs(self.dashing) <= 50:
-            super().render(surf, offset=offset)
+            super().render(surf, offset=offset, alpha=alpha, outline=outline)
 
     # Jump method, called when player jumps
     def jump(self):
@@ -316,7 +336,7 @@ class Player(PhysicsEntity):
     # Dash method for the player, play audio, set dashing to value in right direction
     def dash(self):
         if not self.dashing:
-            self.game.sfx['dash'].play()
+            self.game.audio.play('dash')
             if self.flip:
                 self.dashing = -60
             else:
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+
+import pygame
+
+from scripts.utils import circle_surf
+
+# Glow cache class, keeps finished glow sprites (a core circle with halo rings around it) so a glowing particle is one blit instead of nine new surfaces every frame
+class GlowCache:
+    # Initialize the cache, radius_step is how close two radii have to be to share a sprite, max_sprites is how many sprites are kept before the oldest one is thrown away
+    def __init__(self, radius_step=0.05, max_sprites=64, halo_layers=range(2, 10)):
+        self.radius_step = radius_step
+        self.max_sprites = max_sprites
+        self.halo_layers = halo_layers # the halo rings are the core radius times these numbers
+        self.sprites = OrderedDict() # (quantised radius, color, halo color) -> sprite, the least recently used sprite is first
+
+    # Draws the core and all the halo rings onto one surface, everything is added together just like when they were blitted one by one with BLEND_RGB_ADD
+    def build(self, radius, color, halo_color):
+        outer_radius = radius * max(self.halo_layers)
+        surf = pygame.Surface((int(outer_radius * 2), int(outer_radius * 2)))
+        circles = [(radius, color)] + [(radius * x, halo_color) for x in self.halo_layers]
+        for circle_radius, circle_color in circles:
+            surf.blit(circle_surf(circle_radius, circle_color), (int(outer_radius - circle_radius), int(outer_radius - circle_radius)), special_flags=pygame.BLEND_RGB_ADD)
+        return surf
+
+    # Returns the glow sprite for a radius, the sprite is centered on the particle, returns None if the radius is too small to draw
+    def get(self, radius, color=(150, 150, 150), halo_color=(2, 2, 2)):
+        steps = round(radius / self.radius_step)
+        if steps <= 0:
+            return None
+        key = (steps, color, halo_color)
+        if key in self.sprites:
+            self.sprites.move_to_end(key)
+        else:
+            self.sprites[key] = self.build(steps * self.radius_step, color, halo_color)
+            if len(self.sprites) > self.max_sprites:
+                self.sprites.popitem(last=False)
+        return self.sprites[key]
@@ -0,0 +1,37 @@
+import pygame
+
+# Turns a time array [minutes, seconds, hundredths] into text like 01:05:09
+def format_time(time):
+    return '%02d:%02d:%02d' % (time[0], time[1], int(time[2]))
+
+# Text class for the HUD, the font is loaded once and text is never rendered again if it didn't change
+class HudText:
+    def __init__(self, font_name, size, color=(255, 255, 255)):
+        self.font = pygame.font.SysFont(font_name, size)
+        self.color = color
+        self.glyphs = {} # character -> (rendered character, how far to move before the next character)
+        self.text = None # the text that is in self.surf
+        self.surf = None
+
+    # Returns a rendered character, every character is only rendered the first time it is used
+    def glyph(self, char):
+        if char not in self.glyphs:
+            metrics = self.font.metrics(char)[0]
+            img = self.font.render(char, True, self.color)
+            self.glyphs[char] = (img, metrics[4] if metrics else img.get_width())
+        return self.glyphs[char]
+
+    # Draws text one cached character at a time, for text that changes every frame like the timer
+    def draw_glyphs(self, surf, text, pos):
+        x = pos[0]
+        for char in text:
+            img, advance = self.glyph(char)
+            surf.blit(img, (x, pos[1]))
+            x += advance
+
+    # Draws text that changes now and then, it is only rendered again when it is different from last time
+    def draw(self, surf, text, pos):
+        if text != self.text:
+            self.text = text
+            self.surf = self.font.render(text, True, self.color)
+        surf.blit(self.surf, pos)
@@ -0,0 +1,245 @@
+import os
+import json
+import queue
+import threading
+
+from scripts.tilemap import AUTOTILE_SHIFTS
+
+# Actions written to the journal before the whole map is saved and the journal starts over
+COMPACT_EVERY = 100
+
+# Modified time and size of a file, or None if it doesn't exist, the journal only belongs to the map file it was started for
+def file_stamp(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+# Returns the action that undoes an action
+def inverse(action):
+    return {'tiles': [[x, y, after, before] for x, y, before, after in action['tiles']], 'offgrid': [[after, before] for before, after in reversed(action['offgrid'])]}
+
+# Edit journal class, every change the editor makes to the tilemap goes through it
+# Changes are grouped into actions (everything done between pressing and releasing a mouse button)
+# An action only holds the cells and offgrid tiles that changed, with what they were before and after, so putting the before back undoes it
+# Every action is one line in the journal file next to the map, written by a background thread
+# Every COMPACT_EVERY actions, when O is pressed and when the editor closes the whole map is saved in the background and the journal starts over
+# If the editor crashes, loading the map file and the journal gives the map as it was after the last action
+#
+# Journal file: the first line is {"base": stamp of the map file}, then one action per line:
+#   {"tiles": [[x, y, before, after], ...], "offgrid": [[before, after], ...]}
+# A tile state is [type, variant] or null for an empty cell, an offgrid state is the offgrid tile or null
+class EditJournal:
+    def __init__(self, tilemap, path):
+        self.tilemap = tilemap
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.action = None # the action being recorded, {'tiles': {(x, y): [before, after]}, 'offgrid': [[before, after], ...]}
+        self.undo_stack = []
+        self.redo_stack = []
+        self.since_compact = 0 # actions written since the map file was saved
+        self.queue = queue.Queue() # ('line', text), ('snapshot', tilemap snapshot), ('start', None) or ('stop', None) for the background thread
+        self.error = None # exception of the background thread, raised again on the next save
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+        self.recovered = self.recover() # actions put back from the journal of an earlier session, the editor shows it
+        if self.recovered:
+            self.since_compact = self.recovered
+            self.compact()
+        else:
+            self.queue.put(('start', None))
+
+    # Applies the journal of an earlier session that didn't close properly, returns how many actions were applied
+    def recover(self):
+        if not os.path.exists(self.journal_path):
+            return 0
+        f = open(self.journal_path, 'r')
+        lines = f.read().splitlines()
+        f.close()
+        if not lines or json.loads(lines[0]).get('base') != file_stamp(self.path):
+            return 0 # the map file was saved after this journal was started, everything in it is already in the map
+        count = 0
+        for line in lines[1:]:
+            try:
+                action = json.loads(line)
+            except ValueError: # the last line can be cut off if the editor crashed while writing it
+                break
+            self.apply(action)
+            count += 1
+        return count
+
+    # Background thread, writes the lines and saves the snapshots in the order they were queued
+    def write_loop(self):
+        f = None
+        try:
+            while True:
+                kind, data = self.queue.get()
+                if kind == 'line':
+                    f.write(data + '\n')
+                elif kind == 'snapshot':
+                    # Saved under another name first, so a crash while saving leaves the old map and journal as they were
+                    if f:
+                        f.close()
+                    temp_path = os.path.join(os.path.dirname(self.path), 'saving_' + os.path.basename(self.path))
+                    self.tilemap.save(temp_path, data)
+                    os.replace(temp_path, self.path)
+                    f = self.start_file()
+                elif kind == 'start':
+                    f = self.start_file()
+                if kind == 'stop' or self.queue.empty():
+                    # Lines that come in together are written to the disk together
+                    f.flush()
+                    os.fsync(f.fileno())
+                if kind == 'stop':
+                    f.close()
+                    return
+        except Exception as e:
+            self.error = e
+
+    # Empties the journal file, it starts over from the map file as it is now
+    def start_file(self):
+        f = open(self.journal_path, 'w')
+        f.write(json.dumps({'base': file_stamp(self.path)}) + '\n')
+        return f
+
+    # Starts recording an action, every change until end is undone together
+    def begin(self):
+        if self.action is None:
+            self.action = {'tiles': {}, 'offgrid': []}
+
+    # Ends the action being recorded, it is written to the journal if it changed anything
+    def end(self):
+        action = self.action
+        self.action = None
+        if action is None:
+            return
+        action = {'tiles': [[x, y, before, after] for (x, y), (before, after) in action['tiles'].items() if before != after], 'offgrid': action['offgrid']}
+        if not action['tiles'] and not action['offgrid']:
+            return
+        self.undo_stack.append(action)
+        self.redo_stack = []
+        self.write(action)
+
+    def write(self, action):
+        self.queue.put(('line', json.dumps(action, separators=(',', ':'))))
+        self.since_compact += 1
+        if self.since_compact >= COMPACT_EVERY:
+            self.compact()
+
+    # Saves the whole map in the background and starts the journal over, only the copy of the tilemap is made now
+    def compact(self):
+        if self.error:
+            error = self.error
+            self.error = None
+            raise error
+        if self.action is not None:
+            self.end()
+            if not self.since_compact: # ending the action already compacted
+                return
+        self.queue.put(('snapshot', self.tilemap.snapshot()))
+        self.since_compact = 0
+
+    # Saves what isn't saved yet and waits for the background thread to be done, called when the editor closes
+    def close(self):
+        self.end()
+        if self.since_compact:
+            self.compact()
+        self.queue.put(('stop', None))
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+    # Records a change, before is {(x, y): what the cell was before} for every cell that can have changed
+    # added and removed are the offgrid tiles that were added and removed
+    # This is also how the region operations of the tilemap are recorded, they return what the cells were before
+    def record(self, before, added=(), removed=()):
+        started = self.action is None
+        self.begin()
+        tiles = self.action['tiles']
+        for cell, state in before.items():
+            if cell in tiles:
+                tiles[cell][1] = self.tilemap.tile_state(*cell)
+            else:
+                tiles[cell] = [state, self.tilemap.tile_state(*cell)]
+        for tile in removed:
+            self.action['offgrid'].append([dict(tile), None])
+        for tile in added:
+            self.action['offgrid'].append([None, dict(tile)])
+        if started:
+            self.end()
+
+    # The cells placing or removing a tile at a grid position can change, autotiling changes the four neighbours too
+    # Returns {(x, y): [type, variant] or None} of them
+    def cells_around(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        cells = [(x, y)] + [(x + shift[0], y + shift[1]) for bit, shift in AUTOTILE_SHIFTS]
+        return {cell: self.tilemap.tile_state(*cell) for cell in cells}
+
+    # Places a tile and autotiles it and its neighbours
+    def set_tile(self, pos, tile_type, variant=0):
+        before = self.cells_around(pos)
+        self.tilemap.set_tile(pos, tile_type, variant)
+        self.tilemap.autotile_around(pos)
+        self.record(before)
+
+    # Removes a tile and autotiles its neighbours, returns True if there was a tile to remove
+    def remove_tile(self, pos):
+        before = self.cells_around(pos)
+        if not self.tilemap.remove_tile(pos):
+            return False
+        self.tilemap.autotile_around(pos)
+        self.record(before)
+        return True
+
+    def add_offgrid(self, tile):
+        tile = {'type': tile['type'], 'variant': tile['variant'], 'pos': list(tile['pos'])} # the pos is a list like in the saved map, so the tile is equal to the one read back from the journal
+        self.tilemap.add_offgrid(tile)
+        self.record({}, added=[tile])
+
+    def remove_offgrid(self, tile):
+        self.tilemap.remove_offgrid(tile)
+        self.record({}, removed=[tile])
+
+    # Region operations, recorded as one change
+    def fill_rect(self, rect, tile_type, variant=0):
+        self.record(self.tilemap.fill_rect(rect, tile_type, variant))
+
+    def clear_rect(self, rect):
+        before, removed = self.tilemap.clear_rect(rect)
+        self.record(before, removed=removed)
+
+    def paste(self, prefab, pos):
+        before, added = self.tilemap.paste(prefab, pos)
+        self.record(before, added=added)
+
+    def flood_fill(self, pos, tile_type, variant=0):
+        self.record(self.tilemap.flood_fill(pos, tile_type, variant))
+
+    # Makes the changes of an action, without recording them
+    # The cells are written in one go and not autotiled, the action already has the autotiled variants
+    # Offgrid tiles are found by being equal, any of two equal tiles is as good as the other
+    def apply(self, action):
+        self.tilemap.write_cells({(x, y): after for x, y, before, after in action['tiles']}, autotile=False)
+        for before, after in action['offgrid']:
+            if before:
+                self.tilemap.remove_offgrid(before)
+            if after:
+                self.tilemap.add_offgrid(dict(after))
+
+    # Undoes the last action, the undo is written to the journal as an action of its own
+    def undo(self):
+        self.end()
+        if self.undo_stack:
+            action = self.undo_stack.pop()
+            self.apply(inverse(action))
+            self.redo_stack.append(action)
+            self.write(inverse(action))
+
+    def redo(self):
+        self.end()
+        if self.redo_stack:
+            action = self.redo_stack.pop()
+            self.apply(action)
+            self.undo_stack.append(action)
+            self.write(action)
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import struct
+from array import array
+
+# Binary level files (.map), a compact version of the json levels that loads straight into the chunk arrays of the tilemap
+#
+# Layout, everything little endian:
+#   header        magic b'QQMP', version, tile size, chunk shift, type count, chunk count, offgrid count
+#   bounds        smallest and biggest x and y of the grid tiles
+#   type table    every tile type name once, as a length byte and utf-8, the chunks and offgrid records use the index in this table
+#   chunk index   chunk x, chunk y, tile count and a mask of which types are in the chunk (bit = type index), one entry per chunk
+#   chunk data    for every chunk in index order: the type of every cell (int16, -1 is empty) then the variant of every cell (int16), row by row
+#   offgrid       type index, variant, which coordinates were whole numbers, x and y as doubles, in the same order as the offgrid list
+#
+# The chunk data has a fixed size, so any chunk can be read without reading the ones before it
+
+MAGIC = b'QQMP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHBHII')
+BOUNDS = struct.Struct('<iiii')
+CHUNK_ENTRY = struct.Struct('<iiHQ')
+OFFGRID_RECORD = struct.Struct('<HhBdd')
+EMPTY = -1
+INT_X = 1 # offgrid flags, set when the coordinate was an int in the json file, so converting back gives the exact same file content
+INT_Y = 2
+CHECK_FOLDERS = ['data/maps', 'data/old_maps'] # what --check looks at when it gets no paths, relative to the PythonGame folder
+
+# A parsed .map file, the tile arrays are only made when they are asked for
+# data can be bytes or a memory map of the file, then only the parts that are used are read from the disk
+class MapFile:
+    def __init__(self, data):
+        self.data = data
+        magic, self.version, self.tile_size, self.chunk_shift, type_count, chunk_count, offgrid_count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('not a map file')
+        if self.version > VERSION:
+            raise ValueError('map file version ' + str(self.version) + ' is newer than this game can read')
+        offset = HEADER.size
+        self.bounds = list(BOUNDS.unpack_from(data, offset))
+        offset += BOUNDS.size
+
+        self.tile_types = []
+        for i in range(type_count):
+            length = data[offset]
+            self.tile_types.append(bytes(data[offset + 1:offset + 1 + length]).decode('utf-8'))
+            offset += 1 + length
+
+        self.cells = 1 << (self.chunk_shift * 2) # cells in one chunk
+        self.chunk_keys = [] # (chunk x, chunk y) of every chunk, in file order
+        self.chunk_counts = [] # amount of tiles in every chunk
+        self.type_masks = [] # bit i is set if type i is in the chunk
+        for cx, cy, count, mask in CHUNK_ENTRY.iter_unpack(memoryview(data)[offset:offset + chunk_count * CHUNK_ENTRY.size]):
+            self.chunk_keys.append((cx, cy))
+            self.chunk_counts.append(count)
+            self.type_masks.append(mask)
+        offset += chunk_count * CHUNK_ENTRY.size
+
+        self.chunk_start = offset
+        self.offgrid_start = offset + chunk_count * self.cells * 4
+        self.offgrid_count = offgrid_count
+        self.positions = {} # type index -> [(x, y, variant), ...] of the grid tiles of that type, made when they are first asked for
+
+    # Returns the type and variant arrays of the chunk at an index
+    def chunk_arrays(self, i):
+        start = self.chunk_start + i * self.cells * 4
+        types = array('h')
+        types.frombytes(self.data[start:start + self.cells * 2])
+        variants = array('h')
+        variants.frombytes(self.data[start + self.cells * 2:start + self.cells * 4])
+        if sys.byteorder == 'big':
+            types.byteswap()
+            variants.byteswap()
+        return types, variants
+
+    # Returns [(x, y, variant), ...] of every grid tile of a type, only the chunks with the type in their mask are read
+    def tile_positions(self, type_index):
+        if type_index not in self.positions:
+            positions = []
+            mask = (1 << self.chunk_shift) - 1
+            for i, (cx, cy) in enumerate(self.chunk_keys):
+                if self.type_masks[i] >> type_index & 1:
+                    types, variants = self.chunk_arrays(i)
+                    for cell in range(self.cells):
+                        if types[cell] == type_index:
+                            positions.append(((cx << self.chunk_shift) | (cell & mask), (cy << self.chunk_shift) | (cell >> self.chunk_shift), variants[cell]))
+            self.positions[type_index] = positions
+        return self.positions[type_index]
+
+    # Returns the offgrid tiles as the same dicts as in the json files
+    def offgrid(self):
+        tiles = []
+        for i in range(self.offgrid_count):
+            type_index, variant, flags, x, y = OFFGRID_RECORD.unpack_from(self.data, self.offgrid_start + i * OFFGRID_RECORD.size)
+            tiles.append({'type': self.tile_types[type_index], 'variant': variant, 'pos': [int(x) if flags & INT_X else x, int(y) if flags & INT_Y else y]})
+        return tiles
+
+# Reads a .map file
+def read(path):
+    f = open(path, 'rb')
+    data = f.read()
+    f.close()
+    return MapFile(data)
+
+# Writes a .map file
+# chunks is (chunk x, chunk y) -> (type array, variant array) with the types as indexes in tile_types, cells that are EMPTY are empty
+def write(path, tile_size, chunk_shift, tile_types, chunks, offgrid):
+    tile_types = list(tile_types)
+    type_indexes = {tile_type: i for i, tile_type in enumerate(tile_types)}
+    for tile in offgrid:
+        if tile['type'] not in type_indexes:
+            type_indexes[tile['type']] = len(tile_types)
+            tile_types.append(tile['type'])
+    if len(tile_types) > 64:
+        raise ValueError('a map file can have at most 64 tile types')
+
+    size = 1 << chunk_shift
+    keys = sorted(key for key in chunks if any(t != EMPTY for t in chunks[key][0]))
+    bounds = [0, 0, 0, 0]
+    index = []
+    for n, key in enumerate(keys):
+        types = chunks[key][0]
+        mask = 0
+        count = 0
+        for cell, t in enumerate(types):
+            if t != EMPTY:
+                mask |= 1 << t
+                count += 1
+                x = (key[0] << chunk_shift) | (cell & (size - 1))
+                y = (key[1] << chunk_shift) | (cell >> chunk_shift)
+                if n == 0 and count == 1:
+                    bounds = [x, x, y, y]
+                bounds = [min(bounds[0], x), max(bounds[1], x), min(bounds[2], y), max(bounds[3], y)]
+        index.append(CHUNK_ENTRY.pack(key[0], key[1], count, mask))
+
+    parts = [HEADER.pack(MAGIC, VERSION, tile_size, chunk_shift, len(tile_types), len(keys), len(offgrid)), BOUNDS.pack(*bounds)]
+    for tile_type in tile_types:
+        name = tile_type.encode('utf-8')
+        parts.append(bytes([len(name)]) + name)
+    parts += index
+    for key in keys:
+        for cells in chunks[key]:
+            cells = array('h', cells)
+            if sys.byteorder == 'big':
+                cells.byteswap()
+            parts.append(cells.tobytes())
+    for tile in offgrid:
+        x, y = tile['pos']
+        flags = (INT_X if isinstance(x, int) else 0) | (INT_Y if isinstance(y, int) else 0)
+        parts.append(OFFGRID_RECORD.pack(type_indexes[tile['type']], tile['variant'], flags, x, y))
+
+    f = open(path, 'wb')
+    f.write(b''.join(parts))
+    f.close()
+
+# Converts the content of a json level to a .map file
+def json_to_map(map_data, path, chunk_shift=3):
+    size = 1 << chunk_shift
+    tile_types = []
+    type_indexes = {}
+    chunks = {}
+    for tile in map_data['tilemap'].values():
+        if tile['type'] not in type_indexes:
+            type_indexes[tile['type']] = len(tile_types)
+            tile_types.append(tile['type'])
+        x, y = int(tile['pos'][0]), int(tile['pos'][1])
+        key = (x >> chunk_shift, y >> chunk_shift)
+        if key not in chunks:
+            chunks[key] = (array('h', [EMPTY]) * (size * size), array('h', [0]) * (size * size))
+        cell = ((y & (size - 1)) << chunk_shift) | (x & (size - 1))
+        chunks[key][0][cell] = type_indexes[tile['type']]
+        chunks[key][1][cell] = tile['variant']
+    write(path, map_data['tile_size'], chunk_shift, tile_types, chunks, map_data['offgrid'])
+
+# Converts a .map file back to the content of a json level
+def map_to_json(map_file):
+    tilemap = {}
+    size = 1 << map_file.chunk_shift
+    for i, key in enumerate(map_file.chunk_keys):
+        types, variants = map_file.chunk_arrays(i)
+        for cell in range(map_file.cells):
+            if types[cell] != EMPTY:
+                x = (key[0] << map_file.chunk_shift) | (cell & (size - 1))
+                y = (key[1] << map_file.chunk_shift) | (cell >> map_file.chunk_shift)
+                tilemap[str(x) + ';' + str(y)] = {'type': map_file.tile_types[types[cell]], 'variant': variants[cell], 'pos': [x, y]}
+    return {'tilemap': tilemap, 'tile_size': map_file.tile_size, 'offgrid': map_file.offgrid()}
+
+# Converts files from the command line, .json becomes .map and .map becomes .json next to the old file
+# Run from the PythonGame folder: python -m scripts.mapfile data/maps/*.json
+# --check converts every json file to a map and back in memory and tells if anything was lost, without paths it checks data/maps and data/old_maps
+def main(paths):
+    check = '--check' in paths
+    paths = [path for path in paths if path != '--check']
+    if check and not paths:
+        for folder in CHECK_FOLDERS:
+            paths += [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith('.json')]
+    for path in paths:
+        name, extension = os.path.splitext(path)
+        if extension == '.json':
+            f = open(path, 'r')
+            map_data = json.load(f)
+            f.close()
+            if check:
+                # converted to a temporary file, so a .map that is already next to the json file is kept
+                temp_path = name + '.check.map'
+                json_to_map(map_data, temp_path)
+                same = map_to_json(read(temp_path)) == map_data
+                os.remove(temp_path)
+                print(path, 'ok' if same else 'CHANGED')
+            else:
+                json_to_map(map_data, name + '.map')
+                print(path, '->', name + '.map', os.path.getsize(path), '->', os.path.getsize(name + '.map'), 'bytes')
+        elif extension == '.map':
+            f = open(name + '.json', 'w')
+            json.dump(map_to_json(read(path)), f)
+            f.close()
+            print(path, '->', name + '.json')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,45 @@
+import pygame
+import pygame.gfxdraw
+
+# The dark outline around everything is the shape of the sprite moved one pixel in every direction, drawn behind the sprite
+OUTLINE_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+# Underwater there is only a shadow one pixel down
+SHADOW_OFFSETS = ((0, 1),)
+OUTLINE_COLOR = (0, 0, 0, 180)
+
+# Makes the outline of a surface, the outline is one pixel bigger on every side so it has to be drawn one pixel up and to the left of the surface
+def make_outline(surf, offsets, color=OUTLINE_COLOR):
+    silhouette = pygame.mask.from_surface(surf).to_surface(setcolor=color, unsetcolor=(0, 0, 0, 0))
+    outline = pygame.Surface((surf.get_width() + 2, surf.get_height() + 2), pygame.SRCALPHA)
+    for offset in offsets:
+        outline.blit(silhouette, (1 + offset[0], 1 + offset[1]))
+    return outline
+
+# Outline layer class, the surface the outlines are drawn on plus a cache with the outline of every sprite image
+# Instead of making a mask of the whole screen every frame, every sprite draws its own outline that was made the first time the image was seen
+class OutlineLayer:
+    def __init__(self):
+        self.surf = None
+        self.offsets = OUTLINE_OFFSETS
+        self.sprites = {} # (id of the image, offsets) -> (image, outline), the image is kept so no other image can get its id
+
+    # Call before a frame is drawn, offsets decides if it is outlines or the underwater shadow
+    def begin(self, surf, offsets=OUTLINE_OFFSETS):
+        self.surf = surf
+        self.offsets = offsets
+
+    # Returns the outline of an atlas image, made the first time it is asked for, mirrored sprites are their own atlas image
+    def get(self, img):
+        key = (id(img), self.offsets)
+        if key not in self.sprites:
+            self.sprites[key] = (img, make_outline(img.surface(), self.offsets))
+        return self.sprites[key][1]
+
+    # Draws the outline of an image that is drawn at pos
+    def draw(self, img, pos):
+        self.surf.blit(self.get(img), (int(pos[0]) - 1, int(pos[1]) - 1))
+
+    # Draws the outline of a polygon, used for the sparks which aren't images
+    def draw_polygon(self, points):
+        for offset in self.offsets:
+            pygame.gfxdraw.filled_polygon(self.surf, [(x + offset[0], y + offset[1]) for x, y in points], OUTLINE_COLOR)
@@ -1,32 +1,88 @@
-# Particle class, meant for all types of particles in the game
-class Particle:
-    # Initialize variabels
-    def __init__(self, game, p_type, pos, velocity=[0, 0], frame=0):
+import math
+
+# Particle system class, meant for all types of particles in the game
+# Every particle property is kept in its own list (position, velocity, frame, type), so no object is made per particle and dead particles are removed in one pass
+class ParticleSystem:
+    # Initialize variabels, capacity is how many particles there is room for before the lists have to grow
+    def __init__(self, game, capacity=256):
         self.game = game
-        self.type = p_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets['particle/' + p_type].copy()  # Loads all the images for the animations
-        self.animation.frame = frame
-    
-    # Update the particle position untill it dies/ gets removed
-    def update(self):
-        kill = False
-        if self.animation.done:
-            kill = True
+        self.count = 0 # the particles are the first count entries of every list
+        self.capacity = 0
+        self.types = []
+        self.x = []
+        self.y = []
+        self.vx = []
+        self.vy = []
+        self.frames = []
+        self.animations = {} # particle type -> (images, image duration, frames in the whole animation, loop), shared by all particles of that type
+        self.grow(capacity)
+
+    # Makes room for more particles, only happens when the lists are full
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.types += [None] * extra
+        self.x += [0.0] * extra
+        self.y += [0.0] * extra
+        self.vx += [0.0] * extra
+        self.vy += [0.0] * extra
+        self.frames += [0] * extra
+        self.capacity = capacity
 
+    # Removes every particle
+    def clear(self):
+        self.count = 0
+
+    # Adds a particle, the images come from the animation in the game assets which all particles of the same type share
+    def spawn(self, p_type, pos, velocity=(0, 0), frame=0):
+        if p_type not in self.animations:
+            animation = self.game.assets['particle/' + p_type]
+            self.animations[p_type] = (animation.images, animation.img_duration, animation.img_duration * len(animation.images), animation.loop)
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+        i = self.count
+        self.types[i] = p_type
+        self.x[i] = pos[0]
+        self.y[i] = pos[1]
+        self.vx[i] = velocity[0]
+        self.vy[i] = velocity[1]
+        self.frames[i] = frame
+        self.count += 1
+
+    # Moves every particle, flips through the animations and removes the particles whose animation is done
+    # The particles that are still alive are moved down to fill the holes as we go, so the order is kept and nothing has to be removed from the middle of a list
+    def update(self):
+        types, x, y, vx, vy, frames = self.types, self.x, self.y, self.vx, self.vy, self.frames
+        animations = self.animations
+        alive = 0
+        for i in range(self.count):
+            p_type = types[i]
+            length, loop = animations[p_type][2:]
+            frame = frames[i]
+            if loop:
+                frame = (frame + 1) % length
+            elif frame >= length - 1: # the animation was done, the particle dies
+                continue
+            else:
+                frame += 1
 
-        self.pos[0] += self.velocity[0] # x pos
-        self.pos[1] += self.velocity[1] # y pos
+            new_x = x[i] + vx[i]
+            if p_type == 'leaf': # leaves sway from side to side when they fall
+                new_x += math.sin(frame * 0.035) * 0.3
 
-        self.animation.update()
+            types[alive] = p_type
+            x[alive] = new_x
+            y[alive] = y[i] + vy[i]
+            vx[alive] = vx[i]
+            vy[alive] = vy[i]
+            frames[alive] = frame
+            alive += 1
+        self.count = alive
 
-        return kill
-    
-    # Render the particle
-    def render(self, surf, offset=(0,0), gem=False):
-        img = self.animation.img()
-        if gem: # if it is a gem render it from top left corner and not middle
-            surf.blit(img, (self.pos[0] - offset[0], self.pos[1] - offset[1]))
-        else: # else middle
-            surf.blit(img, (self.pos[0] - offset[0] - img.get_width() // 2, self.pos[1] - offset[1] - img.get_height() // 2))
\ No newline at end of file
+    # Render every particle with one blits call, every frame is a part of an atlas page so most blits read from the same surface
+    def render(self, surf, offset=(0, 0)):
+        blits = []
+        for i in range(self.count):
+            images, img_duration = self.animations[self.types[i]][:2]
+            img = images[int(self.frames[i] / img_duration)]
+            blits.append((img.page, (self.x[i] - offset[0] - img.width // 2, self.y[i] - offset[1] - img.height // 2), img.rect))
+        surf.blits(blits, doreturn=False)
@@ -0,0 +1,150 @@
+import time
+from collections import deque
+
+import pygame
+
+FRAME_BUDGET = 1000 / 60 # milliseconds one frame can take at 60 fps
+
+# Zone class, times one named part of a frame, used as a with block
+class ProfilerZone:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+# Zone that does nothing, handed out while the profiler is turned off so timing costs almost nothing
+class NullZone:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+NULL_ZONE = NullZone()
+
+# Returns the value below which a share (0 - 1) of the sorted samples are
+def percentile(sorted_samples, share):
+    if not sorted_samples:
+        return 0
+    return sorted_samples[min(len(sorted_samples) - 1, int(share * len(sorted_samples)))]
+
+# Profiler class, adds up how long every zone takes each frame and keeps the last frames for statistics
+class Profiler:
+    # Initialize the profiler, history is how many frames are kept, None keeps every frame
+    def __init__(self, enabled=False, history=600):
+        self.enabled = enabled
+        self.history = history
+        self.zones = {} # name -> ProfilerZone, made once per name and reused
+        self.current = {} # name -> seconds spent in the zone this frame
+        self.samples = {} # name -> milliseconds per frame, oldest first, 'frame' is the whole frame
+        self.frames = 0 # frames recorded
+        self.frame_start = 0
+
+    # Returns the with block for a zone, the time is added to the zone every time the block is used in a frame
+    def zone(self, name):
+        if not self.enabled:
+            return NULL_ZONE
+        if name not in self.zones:
+            self.zones[name] = ProfilerZone(self, name)
+        return self.zones[name]
+
+    # Adds time to a zone for the current frame
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0) + seconds
+
+    # Call when a frame starts, also done while turned off so the profiler can be turned on in the middle of a frame
+    def begin_frame(self):
+        self.current = {}
+        self.frame_start = time.perf_counter()
+
+    # Call when a frame ends, saves the time of every zone, zones that weren't used this frame count as 0
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.current['frame'] = time.perf_counter() - self.frame_start
+        for name in self.current:
+            if name not in self.samples:
+                self.samples[name] = deque([0] * min(self.frames, self.history or self.frames), maxlen=self.history)
+        for name, samples in self.samples.items():
+            samples.append(self.current.get(name, 0) * 1000)
+        self.frames += 1
+
+    # Throws away every recorded frame
+    def reset(self):
+        self.current = {}
+        self.samples = {}
+        self.frames = 0
+
+    # Returns the last recorded frame, zone name -> milliseconds
+    def last_frame(self):
+        return {name: samples[-1] for name, samples in self.samples.items() if samples}
+
+    # Returns the mean milliseconds of every zone over the last frames, what the overlay shows so the numbers don't flicker
+    def recent(self, frames=30):
+        recent = {}
+        for name, samples in self.samples.items():
+            count = min(frames, len(samples))
+            if count:
+                recent[name] = sum(samples[i] for i in range(len(samples) - count, len(samples))) / count
+        return recent
+
+    # Writes every recorded frame to a CSV file, one row per frame and one column per zone in milliseconds
+    def dump_csv(self, path):
+        names = ['frame'] + sorted(name for name in self.samples if name != 'frame')
+        columns = [self.samples.get(name, []) for name in names]
+        f = open(path, 'w')
+        f.write(','.join(['index'] + names) + '\n')
+        for i in range(min(len(column) for column in columns)):
+            f.write(','.join([str(i)] + ['%.4f' % column[i] for column in columns]) + '\n')
+        f.close()
+
+    # Returns mean, p95, p99 and max in milliseconds for every zone over the recorded frames
+    def stats(self):
+        stats = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            stats[name] = {
+                'mean': sum(ordered) / len(ordered) if ordered else 0,
+                'p95': percentile(ordered, 0.95),
+                'p99': percentile(ordered, 0.99),
+                'max': ordered[-1] if ordered else 0,
+            }
+        return stats
+
+# Overlay class, draws the live zone timings and how much of the frame budget is used in the corner of the screen
+class ProfilerOverlay:
+    # Initialize the overlay, the font is only loaded once
+    def __init__(self, profiler, pos=(10, 10), font_size=16):
+        self.profiler = profiler
+        self.pos = pos
+        self.font = pygame.font.Font(None, font_size)
+        self.line_height = self.font.get_linesize()
+
+    def render(self, surf):
+        recent = self.profiler.recent()
+        if 'frame' not in recent:
+            return
+        zones = sorted((name for name in recent if name != 'frame'), key=lambda name: -recent[name])
+        lines = [('frame', recent['frame']), ('budget %', recent['frame'] / FRAME_BUDGET * 100)] + [(name, recent[name]) for name in zones]
+
+        # Dark box behind the text
+        box = pygame.Surface((150, self.line_height * len(lines) + 14), pygame.SRCALPHA)
+        box.fill((0, 0, 0, 170))
+        surf.blit(box, self.pos)
+
+        # Bar with the share of the frame budget used, red when the frame is over budget
+        used = min(1, recent['frame'] / FRAME_BUDGET)
+        pygame.draw.rect(surf, (220, 60, 60) if used >= 1 else (80, 200, 80), (self.pos[0] + 4, self.pos[1] + 4, int(142 * used), 4))
+
+        # Zone names on the left, milliseconds lined up on the right
+        for i, (name, value) in enumerate(lines):
+            y = self.pos[1] + 12 + i * self.line_height
+            surf.blit(self.font.render(name, True, (255, 255, 255)), (self.pos[0] + 4, y))
+            number = self.font.render('%.2f' % value, True, (255, 255, 255))
+            surf.blit(number, (self.pos[0] + 146 - number.get_width(), y))
@@ -0,0 +1,112 @@
+import math
+import random
+
+# Steps a projectile flies before it disappears on its own
+PROJECTILE_LIFETIME = 360
+
+# Projectile system class, every projectile the enemies shoot
+# The projectiles live in slots, every property is kept in its own list and the slots of the projectiles that are gone are kept in a free list
+# Shooting takes a slot from the free list, so after the first few shots nothing new is made no matter how much is shot
+class ProjectileSystem:
+    # Initialize variabels, capacity is how many projectiles there is room for before the lists have to grow
+    def __init__(self, game, capacity=64):
+        self.game = game
+        self.count = 0 # projectiles that are flying
+        self.used = 0 # slots that were handed out so far, the slots after it were never used
+        self.capacity = 0
+        self.x = []
+        self.y = []
+        self.direction = [] # pixels moved sideways every step, the sign is the direction
+        self.timer = []
+        self.active = []
+        self.free = [] # slots below used that are empty
+        self.grow(capacity)
+
+    # Makes room for more projectiles, only happens when every slot is taken
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.x += [0.0] * extra
+        self.y += [0.0] * extra
+        self.direction += [0.0] * extra
+        self.timer += [0] * extra
+        self.active += [False] * extra
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    # Removes every projectile
+    def clear(self):
+        for i in range(self.used):
+            self.active[i] = False
+        self.count = 0
+        self.used = 0
+        self.free = []
+
+    # Adds a projectile, returns its slot
+    def spawn(self, pos, direction):
+        if self.free:
+            i = self.free.pop()
+        else:
+            if self.used == self.capacity:
+                self.grow(self.capacity * 2)
+            i = self.used
+            self.used += 1
+        self.x[i] = pos[0]
+        self.y[i] = pos[1]
+        self.direction[i] = direction
+        self.timer[i] = 0
+        self.active[i] = True
+        self.count += 1
+        return i
+
+    def kill(self, i):
+        self.active[i] = False
+        self.free.append(i)
+        self.count -= 1
+
+    # Moves every projectile and removes the ones that hit a wall, timed out or hit the player, all in one pass over the slots
+    # The move is swept along the tiles, the projectile stops in the first solid tile it passes even if it moved more than a tile
+    def update(self):
+        game = self.game
+        tilemap = game.tilemap
+        size = tilemap.tile_size
+        player_rect = game.player.rect()
+        can_hit = abs(game.player.dashing) < 50
+        x, y, direction, timer, active = self.x, self.y, self.direction, self.timer, self.active
+        for i in range(self.used):
+            if not active[i]:
+                continue
+            new_x = x[i] + direction[i]
+            timer[i] += 1
+            column = tilemap.sweep_x(x[i], new_x, y[i])
+            if column is not None:
+                # Moved past the wall, it is put back at the side of the wall it hit
+                if column != int(new_x // size):
+                    new_x = column * size if direction[i] > 0 else (column + 1) * size - 0.01
+                x[i] = new_x
+                self.kill(i)
+                for n in range(4):
+                    game.sparks.spawn((new_x, y[i]), random.random() - 0.5 + (math.pi if direction[i] > 0 else 0), 2 + random.random())
+                continue
+            x[i] = new_x
+            if timer[i] > PROJECTILE_LIFETIME:
+                self.kill(i)
+            elif can_hit and player_rect.collidepoint(new_x, y[i]):
+                self.kill(i)
+                game.hit_player()
+        if not self.count:
+            # Everything is gone, the next shots can start at the first slot again
+            self.used = 0
+            self.free = []
+
+    # Render the projectiles, they are drawn between their last two positions and all at once
+    # The outlines are drawn on the outline layer if there is one
+    def render(self, surf, img, offset=(0, 0), alpha=1, outline=None):
+        x, y, direction, active = self.x, self.y, self.direction, self.active
+        half_width, half_height = img.get_width() / 2, img.get_height() / 2
+        positions = [(x[i] - direction[i] * (1 - alpha) - half_width - offset[0], y[i] - half_height - offset[1]) for i in range(self.used) if active[i]]
+        surf.blits([(img.page, pos, img.rect) for pos in positions], doreturn=False)
+        if outline:
+            for pos in positions:
+                outline.draw(img, pos)
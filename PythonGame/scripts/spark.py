@@ -2,30 +2,76 @@ import math
 
 import pygame
 
-# Spark class, meant for the sparks when sparks are emitted, like when a shot collides with a wall
-class Spark:
-    def __init__(self, pos, angle, speed):
-        self.pos = list(pos)
-        self.angle = angle
-        self.speed = speed
-
-    # Update the spark pos in the right direction
+# Spark system class, meant for the sparks when sparks are emitted, like when a shot collides with a wall
+# Every spark property is kept in its own list, the direction of a spark never changes so its cos and sin are only calculated once when it is spawned
+class SparkSystem:
+    # Initialize variabels, capacity is how many sparks there is room for before the lists have to grow
+    def __init__(self, capacity=128):
+        self.count = 0 # the sparks are the first count entries of every list
+        self.capacity = 0
+        self.x = []
+        self.y = []
+        self.cos = []
+        self.sin = []
+        self.speed = []
+        self.grow(capacity)
+
+    # Makes room for more sparks, only happens when the lists are full
+    def grow(self, capacity):
+        extra = capacity - self.capacity
+        self.x += [0.0] * extra
+        self.y += [0.0] * extra
+        self.cos += [0.0] * extra
+        self.sin += [0.0] * extra
+        self.speed += [0.0] * extra
+        self.capacity = capacity
+
+    # Removes every spark
+    def clear(self):
+        self.count = 0
+
+    # Adds a spark flying in the direction of angle
+    def spawn(self, pos, angle, speed):
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+        i = self.count
+        self.x[i] = pos[0]
+        self.y[i] = pos[1]
+        self.cos[i] = math.cos(angle)
+        self.sin[i] = math.sin(angle)
+        self.speed[i] = speed
+        self.count += 1
+
+    # Moves every spark in its direction and slows it down, the sparks that stopped are removed in the same pass by moving the others down over them
     def update(self):
-        self.pos[0] += math.cos(self.angle) * self.speed
-        self.pos[1] += math.sin(self.angle) * self.speed
-
-        # Slows down
-        self.speed = max(0, self.speed - 0.1)
-        # Ends when speed is 0
-        return not self.speed
-
-    # Render the spark, make it look good with math, create a polygon between different points
-    def render(self, surf, offset=(0,0)):
-        render_points = [
-            (self.pos[0] + math.cos(self.angle) * self.speed * 3 - offset[0], self.pos[1] + math.sin(self.angle) * self.speed * 3 - offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[0], self.pos[1] + math.sin(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[1]),
-            (self.pos[0] + math.cos(self.angle + math.pi) * self.speed * 3 - offset[0], self.pos[1] + math.sin(self.angle + math.pi) * self.speed * 3 - offset[1]),
-            (self.pos[0] + math.cos(self.angle - math.pi * 0.5) * self.speed * 0.5 - offset[0], self.pos[1] + math.sin(self.angle - math.pi * 0.5) * self.speed * 0.5 - offset[1]),
-        ]
-
-        pygame.draw.polygon(surf, (255,255,255), render_points)
\ No newline at end of file
+        x, y, cos, sin, speed = self.x, self.y, self.cos, self.sin, self.speed
+        alive = 0
+        for i in range(self.count):
+            new_speed = max(0, speed[i] - 0.1)
+            # Ends when speed is 0
+            if not new_speed:
+                continue
+            x[alive] = x[i] + cos[i] * speed[i]
+            y[alive] = y[i] + sin[i] * speed[i]
+            cos[alive] = cos[i]
+            sin[alive] = sin[i]
+            speed[alive] = new_speed
+            alive += 1
+        self.count = alive
+
+    # Render the sparks, every spark is a polygon that is long in its direction and thin to the sides
+    # The outlines are drawn on the outline layer if there is one
+    def render(self, surf, offset=(0,0), outline=None):
+        x, y, cos, sin, speed = self.x, self.y, self.cos, self.sin, self.speed
+        polygons = []
+        for i in range(self.count):
+            px = x[i] - offset[0]
+            py = y[i] - offset[1]
+            long_x, long_y = cos[i] * speed[i] * 3, sin[i] * speed[i] * 3 # point in front and behind
+            side_x, side_y = -sin[i] * speed[i] * 0.5, cos[i] * speed[i] * 0.5 # points to the sides, a quarter turn from the direction
+            polygons.append(((px + long_x, py + long_y), (px + side_x, py + side_y), (px - long_x, py - long_y), (px - side_x, py - side_y)))
+
+        for points in polygons:
+            pygame.draw.polygon(surf, (255,255,255), points)
+            if outline:
+                outline.draw_polygon(points)
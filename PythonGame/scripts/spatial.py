@@ -0,0 +1,90 @@
+import pygame
+
+# Spatial hash class, a uniform grid over the world where every cell knows which items overlap it
+# Things near a rect or point are found by looking at the few cells around it instead of going through every item
+# Items are anything, they are kept by id so they don't have to be hashable
+class SpatialHash:
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {} # (cell x, cell y) -> {id of item: item}
+        self.entries = {} # id of item -> [item, rect, (first cell x, first cell y, last cell x, last cell y)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, item):
+        return id(item) in self.entries
+
+    # The cells a pygame.Rect overlaps
+    def cell_range(self, rect):
+        size = self.cell_size
+        return (rect[0] // size, rect[1] // size, (rect[0] + rect[2] - 1) // size, (rect[1] + rect[3] - 1) // size)
+
+    def clear(self):
+        self.cells = {}
+        self.entries = {}
+
+    # Adds an item that covers a rect
+    def insert(self, item, rect):
+        key = id(item)
+        rect = pygame.Rect(rect)
+        cells = self.cell_range(rect)
+        self.entries[key] = [item, rect, cells]
+        for cx in range(cells[0], cells[2] + 1):
+            for cy in range(cells[1], cells[3] + 1):
+                self.cells.setdefault((cx, cy), {})[key] = item
+
+    def remove(self, item):
+        key = id(item)
+        item, rect, cells = self.entries.pop(key)
+        for cx in range(cells[0], cells[2] + 1):
+            for cy in range(cells[1], cells[3] + 1):
+                cell = self.cells[(cx, cy)]
+                del cell[key]
+                if not cell:
+                    del self.cells[(cx, cy)]
+
+    # Tells the hash an item moved, most moves stay inside the same cells and only change the saved rect
+    def move(self, item, rect):
+        rect = pygame.Rect(rect)
+        entry = self.entries.get(id(item))
+        if entry is None:
+            self.insert(item, rect)
+            return
+        if self.cell_range(rect) == entry[2]:
+            entry[1].update(rect)
+            return
+        self.remove(item)
+        self.insert(item, rect)
+
+    # Returns the items whose rect overlaps a rect
+    def query_rect(self, rect):
+        rect = pygame.Rect(rect)
+        cells = self.cell_range(rect)
+        found = {}
+        for cx in range(cells[0], cells[2] + 1):
+            for cy in range(cells[1], cells[3] + 1):
+                cell = self.cells.get((cx, cy))
+                if cell:
+                    for key in cell:
+                        if key not in found and rect.colliderect(self.entries[key][1]):
+                            found[key] = cell[key]
+        return list(found.values())
+
+    # Returns the items whose rect contains a point
+    def query_point(self, pos):
+        cell = self.cells.get((int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)))
+        if not cell:
+            return []
+        return [item for key, item in cell.items() if self.entries[key][1].collidepoint(pos)]
+
+    # Returns the items whose rect is at most radius away from a point
+    def query_radius(self, pos, radius):
+        found = []
+        for item in self.query_rect((pos[0] - radius, pos[1] - radius, radius * 2 + 1, radius * 2 + 1)):
+            rect = self.entries[id(item)][1]
+            dx = max(rect.left - pos[0], 0, pos[0] - rect.right + 1)
+            dy = max(rect.top - pos[1], 0, pos[1] - rect.bottom + 1)
+            if dx * dx + dy * dy <= radius * radius:
+                found.append(item)
+        return found
@@ -1,7 +1,13 @@
+import os
 import json
+from array import array
 
 import pygame
 
+from scripts.outline import OUTLINE_COLOR
+from scripts import mapfile
+from scripts.chunkstream import ChunkStream
+
 # The rulebook for when the blocks should autotile
 AUTOTILE_MAP = {
     tuple(sorted([(1, 0), (0, 1)])): 0, 
@@ -24,110 +30,871 @@ RIGHT_KILLABLE_OBJECT = {'spikes_right', 'spikes_left'}
 CHECKPOINTS = {'checkpoints'}
 AUTOTILE_TYPES = {'grass', 'stone'}
 
+# The four neighbours autotiling looks at and the bit each one has in the neighbour mask
+AUTOTILE_SHIFTS = [(1, (1, 0)), (2, (-1, 0)), (4, (0, -1)), (8, (0, 1))]
+
+# AUTOTILE_MAP turned into a table indexed by the neighbour mask, None where the rulebook has no variant so the tile keeps its own
+AUTOTILE_MASKS = [None] * 16
+for neighbours, variant in AUTOTILE_MAP.items():
+    AUTOTILE_MASKS[sum(bit for bit, shift in AUTOTILE_SHIFTS if shift in neighbours)] = variant
+
+# Most cells a flood fill changes, filling a hole in the ground that turns out to be the open sky stops instead of filling the whole map
+FLOOD_LIMIT = 65536
+
+# Folder of the prefabs, pieces of a map saved with copy_rect that can be stamped into any map
+PREFAB_PATH = 'data/prefabs/'
+
+# The grid is stored in square chunks, the size has to be a power of two so the chunk and the cell inside it can be found with a shift and a mask
+CHUNK_SHIFT = 3
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+EMPTY = -1 # type id of a cell without a tile
+
+# Collision classes of the cells in the collision layer
+NO_COLLISION = 0
+SOLID = 1
+TOP_KILL = 2
+SIDE_KILL = 3
+CHECKPOINT = 4
+
+# Returns the collision class of a tile type
+def collision_class(tile_type):
+    if tile_type in PHYSICS_TILES:
+        return SOLID
+    if tile_type in TOP_KILLABLE_OBJECT:
+        return TOP_KILL
+    if tile_type in RIGHT_KILLABLE_OBJECT:
+        return SIDE_KILL
+    if tile_type in CHECKPOINTS:
+        return CHECKPOINT
+    return NO_COLLISION
+
+# Prefab files are json: {"size": [width, height], "tiles": [[x, y, type, variant], ...], "offgrid": [offgrid tiles]}
+# Positions are relative to the top left corner of the prefab, in tiles for the grid tiles and in pixels for the offgrid tiles
+def save_prefab(path, prefab):
+    f = open(path, 'w')
+    json.dump(prefab, f)
+    f.close()
+
+def load_prefab(path):
+    f = open(path, 'r')
+    prefab = json.load(f)
+    f.close()
+    return prefab
+
+# Chunk class, holds the tiles of one CHUNK_SIZE x CHUNK_SIZE square of the grid in two flat arrays instead of one dict per tile
+class TileChunk:
+    def __init__(self):
+        self.types = array('h', [EMPTY]) * (CHUNK_SIZE * CHUNK_SIZE) # type id of every cell, row by row
+        self.variants = array('h', [0]) * (CHUNK_SIZE * CHUNK_SIZE) # variant of every cell
+        self.classes = bytearray(CHUNK_SIZE * CHUNK_SIZE) # collision class of every cell, kept up to date with the tiles so physics never has to look at the type
+        self.count = 0 # amount of tiles in the chunk, so empty chunks can be thrown away
+
+# Result of Tilemap.physics_rects_around, the same object and rects are reused for every query so physics doesn't create anything per frame
+class CollisionQuery:
+    def __init__(self):
+        self.solid = []
+        self.top_kill = [] # spikes killing from above or below
+        self.side_kill = [] # spikes killing from the sides
+        self.layers = [self.solid, self.top_kill, self.side_kill] # everything that blocks movement, the index tells what kind of block it is
+        self.checkpoints = [] # rects of the unclaimed checkpoints
+        self.checkpoint_cells = [] # grid position of every rect in checkpoints
+        self.rect_pool = []
+
+    # Empties the lists before a new query
+    def reset(self):
+        self.solid.clear()
+        self.top_kill.clear()
+        self.side_kill.clear()
+        self.checkpoints.clear()
+        self.checkpoint_cells.clear()
+
 # Tilemap class
 class Tilemap:
     # Initialize tilemap variabels
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {}
-        self.offgrid_tiles = []
+        self.chunks = {} # (chunk x, chunk y) -> TileChunk
+        self.tile_types = [] # type id -> type name
+        self.tile_type_ids = {} # type name -> type id
+        self.type_classes = [] # type id -> collision class
+        self.offgrid_tiles = {} # add number -> offgrid tile, in the order they were added
+        self.offgrid_chunks = {} # (chunk x, chunk y) -> the offgrid tiles whose image overlaps that chunk, in the same order as offgrid_tiles
+        self.offgrid_index = {} # (type, variant) -> {add number: tile} of the offgrid tiles with that type and variant
+        self.offgrid_added = 0 # add number of the next offgrid tile
+        self.offgrid_numbers = {} # id of an offgrid tile -> its add number, tiles are removed and put in order by it
+        self.tile_index = {} # (type id, variant) -> set of the (x, y) grid positions with that tile
+        self.indexed_types = None # type ids that are in tile_index, None when every type is, the types of a .map level are only put in when they are first needed
+        self.index_file = None # (MapFile, {type id: type index in the file}) the types that aren't in tile_index yet are read from
+        self.chunk_surfs = {} # (chunk x, chunk y) -> pre-rendered (surface, pixel position) of the grid tiles in the chunk
+        self.offgrid_surfs = {} # (chunk x, chunk y) -> pre-rendered (surface, pixel position) of the offgrid tiles in the chunk
+        self.outline_surfs = {} # (chunk x, chunk y) -> {outline offsets: pre-rendered outline of everything inside the chunk, or None}
+        self.collision_query = CollisionQuery()
+        self.map_file = None # (path, modified time, MapFile) of the last .map file read, loading the same level again doesn't read the file again
+        self.stream = None # ChunkStream when the level is streamed from its file, it is then also self.chunks, check it with "is not None" since an empty stream is an empty dict
+
+    # Returns the id of a tile type, new types get the next free id
+    def type_id(self, tile_type):
+        if tile_type not in self.tile_type_ids:
+            self.tile_type_ids[tile_type] = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            self.type_classes.append(collision_class(tile_type))
+        return self.tile_type_ids[tile_type]
+
+    # Removes every tile, on grid and offgrid
+    def clear(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.chunks = {}
+        self.offgrid_tiles = {}
+        self.offgrid_chunks = {}
+        self.offgrid_index = {}
+        self.offgrid_added = 0
+        self.offgrid_numbers = {}
+        self.tile_index = {}
+        self.indexed_types = None
+        self.index_file = None
+        self.chunk_surfs = {}
+        self.offgrid_surfs = {}
+        self.outline_surfs = {}
+
+    # Throws away the pre-rendered surfaces of a chunk, they are made again from the tiles when the chunk is drawn again
+    def forget_chunk_surfs(self, key):
+        self.chunk_surfs.pop(key, None)
+        self.offgrid_surfs.pop(key, None)
+        self.outline_surfs.pop(key, None)
+
+    # Throws away the outlines that can include a chunk, the outline of a chunk also depends on the pixels just outside it
+    def forget_outlines(self, key):
+        for cx in range(key[0] - 1, key[0] + 2):
+            for cy in range(key[1] - 1, key[1] + 2):
+                self.outline_surfs.pop((cx, cy), None)
+
+    # The pixel rect the image of an offgrid tile covers
+    def offgrid_rect(self, tile):
+        img = self.game.assets[tile['type']][tile['variant']]
+        return pygame.Rect(int(tile['pos'][0]), int(tile['pos'][1]), img.get_width(), img.get_height())
+
+    # The chunks a pixel rect overlaps
+    def rect_chunk_keys(self, rect):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        keys = []
+        for cx in range(rect.left // chunk_px, (rect.right - 1) // chunk_px + 1):
+            for cy in range(rect.top // chunk_px, (rect.bottom - 1) // chunk_px + 1):
+                keys.append((cx, cy))
+        return keys
+
+    # Which chunks the image of an offgrid tile overlaps, offgrid tiles can be placed anywhere so one image can cover several chunks
+    def offgrid_chunk_keys(self, tile):
+        return self.rect_chunk_keys(self.offgrid_rect(tile))
+
+    # The offgrid tiles whose image overlaps a pixel rect, in the order they were added
+    # offgrid_chunks is the index, only the tiles in the chunks the rect covers are looked at
+    def offgrid_overlapping(self, rect):
+        rect = pygame.Rect(rect)
+        keys = self.rect_chunk_keys(rect)
+        found = {}
+        for key in keys:
+            for tile in self.offgrid_chunks.get(key, ()):
+                if id(tile) not in found and self.offgrid_rect(tile).colliderect(rect):
+                    found[id(tile)] = tile
+        if len(keys) > 1 and len(found) > 1: # tiles from different chunks, the chunk lists are each in order but not together
+            return sorted(found.values(), key=lambda tile: self.offgrid_numbers[id(tile)])
+        return list(found.values())
+
+    # The offgrid tiles whose image covers a pixel position, for picking them with the mouse
+    def offgrid_at(self, pos):
+        return self.offgrid_overlapping((int(pos[0]), int(pos[1]), 1, 1))
+
+    # Adds an offgrid tile and throws away the pre-rendered surfaces of the chunks it overlaps
+    def add_offgrid(self, tile):
+        self.offgrid_tiles[self.offgrid_added] = tile
+        self.offgrid_index.setdefault((tile['type'], tile['variant']), {})[self.offgrid_added] = tile
+        self.offgrid_numbers[id(tile)] = self.offgrid_added
+        self.offgrid_added += 1
+        for key in self.offgrid_chunk_keys(tile):
+            self.offgrid_chunks.setdefault(key, []).append(tile)
+            self.offgrid_surfs.pop(key, None)
+            self.forget_outlines(key)
+
+    # Removes an offgrid tile and throws away the pre-rendered surfaces of the chunks it overlapped
+    # The tile doesn't have to be the same object as the one in the tilemap, an equal one is looked for in the chunk it is in
+    def remove_offgrid(self, tile):
+        if id(tile) not in self.offgrid_numbers:
+            tile = next(stored for stored in self.offgrid_chunks[self.offgrid_chunk_keys(tile)[0]] if stored == tile)
+        self.remove_offgrid_tiles([tile])
+
+    # Removes offgrid tiles that are in the tilemap, they are found by their add number and not by comparing them
+    # Every chunk they overlapped is filtered once, no matter how many of them it had
+    def remove_offgrid_tiles(self, tiles):
+        removed = set()
+        keys = set()
+        for tile in tiles:
+            number = self.offgrid_numbers.pop(id(tile))
+            removed.add(id(tile))
+            del self.offgrid_tiles[number]
+            entries = self.offgrid_index[(tile['type'], tile['variant'])]
+            del entries[number]
+            if not entries:
+                del self.offgrid_index[(tile['type'], tile['variant'])]
+            keys.update(self.offgrid_chunk_keys(tile))
+        for key in keys:
+            bucket = [stored for stored in self.offgrid_chunks[key] if id(stored) not in removed]
+            if bucket:
+                self.offgrid_chunks[key] = bucket
+            else:
+                del self.offgrid_chunks[key]
+            self.offgrid_surfs.pop(key, None)
+            self.forget_outlines(key)
+
+    # Puts the tiles of types that aren't in the tile index yet into it, they are read from the level file
+    # A type is put in before any of its cells change, so the file still has every tile of it
+    def index_types(self, type_ids):
+        if self.indexed_types is None:
+            return
+        map_file, file_types = self.index_file
+        for type_id in type_ids - self.indexed_types:
+            if type_id in file_types:
+                for x, y, variant in map_file.tile_positions(file_types[type_id]):
+                    self.tile_index.setdefault((type_id, variant), set()).add((x, y))
+            self.indexed_types.add(type_id)
+
+    # Keeps the tile index right when a cell changes, old and new are (type id, variant) or None for an empty cell
+    def index_cell(self, pos, old, new):
+        if self.indexed_types is not None:
+            missing = {tile[0] for tile in (old, new) if tile and tile[0] not in self.indexed_types}
+            if missing:
+                self.index_types(missing)
+        if old:
+            cells = self.tile_index[old]
+            cells.discard(pos)
+            if not cells:
+                del self.tile_index[old]
+        if new:
+            self.tile_index.setdefault(new, set()).add(pos)
+
+    # Returns (type id, variant) of the tile at a grid position, or None if the cell is empty
+    def tile_at(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk:
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+            if chunk.types[index] != EMPTY:
+                return chunk.types[index], chunk.variants[index]
+
+    # Returns [type, variant] of the tile at a grid position, or None if the cell is empty
+    def tile_state(self, x, y):
+        tile = self.tile_at(x, y)
+        if tile:
+            return [self.tile_types[tile[0]], tile[1]]
+
+    # Returns the tile at a grid position in the same dict layout as the map files, or None if the cell is empty
+    def get_tile(self, pos):
+        tile = self.tile_at(int(pos[0]), int(pos[1]))
+        if tile:
+            return {'type': self.tile_types[tile[0]], 'variant': tile[1], 'pos': [int(pos[0]), int(pos[1])]}
+
+    # Places a tile at a grid position, replaces the tile that was there before
+    def set_tile(self, pos, tile_type, variant=0):
+        x, y = int(pos[0]), int(pos[1])
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+        if not chunk:
+            chunk = self.chunks[key] = TileChunk()
+        index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        type_id = self.type_id(tile_type)
+        self.index_cell((x, y), (chunk.types[index], chunk.variants[index]) if chunk.types[index] != EMPTY else None, (type_id, variant))
+        if chunk.types[index] == EMPTY:
+            chunk.count += 1
+        chunk.types[index] = type_id
+        chunk.variants[index] = variant
+        chunk.classes[index] = self.type_classes[chunk.types[index]]
+        if self.stream is not None:
+            self.stream.changed.add(key)
+        self.chunk_surfs.pop(key, None)
+        self.forget_outlines(key)
+
+    # Removes the tile at a grid position, returns True if there was a tile to remove
+    def remove_tile(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        chunk = self.chunks.get(key)
+        if chunk:
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+            if chunk.types[index] != EMPTY:
+                if self.stream is not None:
+                    self.stream.changed.add(key)
+                self.index_cell((x, y), (chunk.types[index], chunk.variants[index]), None)
+                chunk.types[index] = EMPTY
+                chunk.variants[index] = 0
+                chunk.classes[index] = NO_COLLISION
+                chunk.count -= 1
+                if not chunk.count:
+                    del self.chunks[key]
+                self.chunk_surfs.pop(key, None)
+                self.forget_outlines(key)
+                return True
+        return False
+
+    # Returns [min x, max x, min y, max y] of the tiles on the grid in tile coordinates, only looks at the chunks touching the edges
+    def bounds(self):
+        if self.stream is not None: # the file knows, tiles changed while playing are not counted
+            return list(self.stream.file.bounds)
+        if not self.chunks:
+            return [0, 0, 0, 0]
+        bounds = [None, None, None, None]
+        min_cx = min(key[0] for key in self.chunks)
+        max_cx = max(key[0] for key in self.chunks)
+        min_cy = min(key[1] for key in self.chunks)
+        max_cy = max(key[1] for key in self.chunks)
+        for (cx, cy), chunk in self.chunks.items():
+            if cx not in {min_cx, max_cx} and cy not in {min_cy, max_cy}:
+                continue
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                if chunk.types[index] != EMPTY:
+                    x = (cx << CHUNK_SHIFT) | (index & CHUNK_MASK)
+                    y = (cy << CHUNK_SHIFT) | (index >> CHUNK_SHIFT)
+                    bounds[0] = x if bounds[0] is None else min(bounds[0], x)
+                    bounds[1] = x if bounds[1] is None else max(bounds[1], x)
+                    bounds[2] = y if bounds[2] is None else min(bounds[2], y)
+                    bounds[3] = y if bounds[3] is None else max(bounds[3], y)
+        return bounds
 
     # Extract a block from the tilemap, in offgridtiles or on grid, returns the extract, can keep or remove the extracted element
+    # The tiles are looked up in the indexes, only the matching tiles are looked at and not the whole map
+    # Offgrid tiles come first in the order they were added, then the grid tiles chunk by chunk and row by row like the map file has them
     def extract(self, id_pairs, keep=False):
-        matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            if (tile['type'], tile['variant']) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]['pos'] = matches[-1]['pos'].copy()
-                matches[-1]['pos'][0] *= self.tile_size
-                matches[-1]['pos'][1] *= self.tile_size
-                if not keep:
-                    del self.tilemap[loc]
+        id_pairs = {tuple(pair) for pair in id_pairs}
+        entries = []
+        for pair in id_pairs:
+            entries += self.offgrid_index.get(pair, {}).items()
+        entries.sort(key=lambda entry: entry[0])
+        matches = [tile.copy() for number, tile in entries]
+        if not keep:
+            self.remove_offgrid_tiles([tile for number, tile in entries])
+
+        type_ids = {self.tile_type_ids[pair[0]] for pair in id_pairs if pair[0] in self.tile_type_ids}
+        self.index_types(type_ids)
+        cells = []
+        for tile_type, variant in id_pairs:
+            if tile_type in self.tile_type_ids:
+                cells += [(x, y, tile_type, variant) for x, y in self.tile_index.get((self.tile_type_ids[tile_type], variant), ())]
+        cells.sort(key=lambda cell: (cell[0] >> CHUNK_SHIFT, cell[1] >> CHUNK_SHIFT, cell[1], cell[0]))
+        for x, y, tile_type, variant in cells:
+            matches.append({'type': tile_type, 'variant': variant, 'pos': [x * self.tile_size, y * self.tile_size]})
+            if not keep:
+                self.remove_tile((x, y))
 
         return matches
 
-    # See which tiles are around a block 
+    # See which tiles are around a block
     def tiles_around(self, pos):
         tiles = []
         tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ';' + str(tile_loc[1] + offset[1])
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            tile = self.get_tile((tile_loc[0] + offset[0], tile_loc[1] + offset[1]))
+            if tile:
+                tiles.append(tile)
         return tiles
-    
+
+    # Copies what save writes, the chunk arrays are copied so the copy can be saved while the tilemap keeps changing
+    def snapshot(self):
+        keys = self.stream.level_keys() if self.stream is not None else list(self.chunks)
+        chunks = {}
+        for key in keys:
+            chunk = self.chunks.get(key)
+            chunks[key] = (array('h', chunk.types), array('h', chunk.variants))
+        return self.tile_size, list(self.tile_types), chunks, [dict(tile) for tile in self.offgrid_tiles.values()]
+
     # Saves the tilemap json file
-    def save(self, path):
+    # .map files are saved in the binary format, everything else as json
+    # snapshot can be what snapshot returned earlier, only the snapshot is used then so it can be saved from another thread
+    def save(self, path, snapshot=None):
+        tile_size, tile_types, chunks, offgrid = snapshot or self.snapshot()
+        if path.endswith('.map'):
+            mapfile.write(path, tile_size, CHUNK_SHIFT, tile_types, chunks, offgrid)
+            return
+        tilemap = {}
+        for (cx, cy), (types, variants) in chunks.items():
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                if types[index] != EMPTY:
+                    x, y = (cx << CHUNK_SHIFT) | (index & CHUNK_MASK), (cy << CHUNK_SHIFT) | (index >> CHUNK_SHIFT)
+                    tilemap[str(x) + ';' + str(y)] = {'type': tile_types[types[index]], 'variant': variants[index], 'pos': [x, y]}
         f = open(path, 'w')
-        json.dump({'tilemap': self.tilemap, 'tile_size': self.tile_size, 'offgrid': self.offgrid_tiles}, f)
+        json.dump({'tilemap': tilemap, 'tile_size': tile_size, 'offgrid': offgrid}, f)
         f.close()
 
-    # Loades the tilemap json file and sets the data
-    def load(self, path):
+    # Loades the tilemap json or .map file and sets the data
+    # If stream_budget is given and a .map level has more chunks than that, the level is streamed from the file instead of read all at once
+    def load(self, path, stream_budget=None):
+        if path.endswith('.map') and stream_budget:
+            modified = os.path.getmtime(path)
+            if self.stream is not None and (self.stream.path, self.stream.modified) == (path, modified):
+                # The same level again, the file is already open
+                stream = self.stream
+                self.stream = None
+                stream.reset()
+                stream.budget = stream_budget
+                self.clear()
+                self.start_stream(stream)
+                return
+            f = open(path, 'rb')
+            header = mapfile.HEADER.unpack_from(f.read(mapfile.HEADER.size))
+            f.close()
+            if header[3] == CHUNK_SHIFT and header[5] > stream_budget:
+                self.clear()
+                self.start_stream(ChunkStream(self, path, budget=stream_budget))
+                return
+        if path.endswith('.map'):
+            modified = os.path.getmtime(path)
+            if not self.map_file or self.map_file[:2] != (path, modified):
+                self.map_file = (path, modified, mapfile.read(path))
+            self.load_map_file(self.map_file[2])
+            return
         f = open(path, 'r')
         map_data = json.load(f)
         f.close()
 
-        self.tilemap = map_data['tilemap']
+        self.clear()
         self.tile_size = map_data['tile_size']
-        self.offgrid_tiles = map_data['offgrid']
+        for tile in map_data['tilemap'].values():
+            self.set_tile(tile['pos'], tile['type'], tile['variant'])
+        for tile in map_data['offgrid']:
+            self.add_offgrid(tile)
+
+    # Makes a chunk from the arrays of chunk i in a .map file, type_ids turns the type indexes of the file into type ids of this tilemap
+    def make_chunk(self, map_file, i, type_ids):
+        types, variants = map_file.chunk_arrays(i)
+        if type_ids != list(range(len(type_ids))):
+            types = array('h', [type_ids[t] if t != EMPTY else EMPTY for t in types])
+        chunk = TileChunk()
+        chunk.types = types
+        chunk.variants = variants
+        chunk.classes = bytearray(self.type_classes[t] if t != EMPTY else NO_COLLISION for t in types)
+        chunk.count = map_file.chunk_counts[i]
+        return chunk
+
+    # The tile index of a level loaded from a .map file starts empty, a type is read from the file the first time it is needed
+    # The file keeps the positions it read, so loading the same level again doesn't look through the map again
+    def index_from(self, map_file, type_ids):
+        self.tile_index = {}
+        self.indexed_types = set()
+        self.index_file = (map_file, {type_id: i for i, type_id in enumerate(type_ids)})
+
+    # Sets the data from a parsed .map file, the chunk arrays are used as they are instead of placing one tile at a time
+    def load_map_file(self, map_file):
+        self.clear()
+        self.tile_size = map_file.tile_size
+        type_ids = [self.type_id(tile_type) for tile_type in map_file.tile_types] # the file has its own type order
+        if map_file.chunk_shift == CHUNK_SHIFT:
+            self.index_from(map_file, type_ids)
+        for i, key in enumerate(map_file.chunk_keys):
+            if map_file.chunk_shift != CHUNK_SHIFT:
+                # Made with another chunk size, the tiles have to be placed one by one
+                types, variants = map_file.chunk_arrays(i)
+                for cell in range(map_file.cells):
+                    if types[cell] != EMPTY:
+                        x = (key[0] << map_file.chunk_shift) | (cell & ((1 << map_file.chunk_shift) - 1))
+                        y = (key[1] << map_file.chunk_shift) | (cell >> map_file.chunk_shift)
+                        self.set_tile((x, y), map_file.tile_types[types[cell]], variants[cell])
+                continue
+            self.chunks[key] = self.make_chunk(map_file, i, type_ids)
+        for tile in map_file.offgrid():
+            self.add_offgrid(tile)
+
+    # Starts streaming a level, the grid chunks stay in the file until they are needed, the offgrid tiles are few so they are all read now
+    def start_stream(self, stream):
+        self.stream = stream
+        self.chunks = stream
+        self.tile_size = stream.file.tile_size
+        self.index_from(stream.file, stream.type_ids)
+        for tile in stream.file.offgrid():
+            self.add_offgrid(tile)
+
+    # Tells a streamed level which parts of the map are in use, rects are pixel rects like the camera view and the entities, the first one should be the camera
+    # direction is where the camera is going, the chunks one view ahead are read before they are needed
+    def stream_around(self, rects, direction=(0, 0)):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        view = rects[0]
+        needed = set()
+        # One chunk extra on every side of the camera, for tiles sticking out of their chunk and the outlines which look one pixel further
+        for cx in range(view.left // chunk_px - 1, view.right // chunk_px + 2):
+            for cy in range(view.top // chunk_px - 1, view.bottom // chunk_px + 2):
+                needed.add((cx, cy))
+        # Physics looks one tile around an entity
+        for rect in rects[1:]:
+            for cx in range((rect.left - self.tile_size) // chunk_px, (rect.right + self.tile_size) // chunk_px + 1):
+                for cy in range((rect.top - self.tile_size) // chunk_px, (rect.bottom + self.tile_size) // chunk_px + 1):
+                    needed.add((cx, cy))
+        ahead = view.move(((direction[0] > 0) - (direction[0] < 0)) * view.width, ((direction[1] > 0) - (direction[1] < 0)) * view.height)
+        upcoming = []
+        for cx in range(ahead.left // chunk_px - 1, ahead.right // chunk_px + 2):
+            for cy in range(ahead.top // chunk_px - 1, ahead.bottom // chunk_px + 2):
+                if (cx, cy) not in needed:
+                    upcoming.append((cx, cy))
+        self.stream.update(needed, upcoming)
+
+        # The pre-rendered surfaces of chunks that are far away are thrown away too, they use more memory than the tiles
+        for surfs in [self.chunk_surfs, self.offgrid_surfs, self.outline_surfs]:
+            if len(surfs) > self.stream.budget:
+                for key in [key for key in surfs if key not in needed]:
+                    del surfs[key]
 
     # Check if a block is a physics block, can be collided with
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ';' + str(int(pos[1] // self.tile_size))
-        if tile_loc in self.tilemap:
-            if self.tilemap[tile_loc]['type'] in PHYSICS_TILES:
-                return self.tilemap[tile_loc]
-    
-    # Checks which physics blocks are around the player, checks for which type it is, returns type
-    def physics_rects_around(self, pos):
-        rects = []
-        vertical_kill_rects = []
-        horizontal_kill_rects = []
-        checkpoints = []
-        for tile in self.tiles_around(pos):
-            if tile['type'] in PHYSICS_TILES:
-                rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-            if tile['type'] in TOP_KILLABLE_OBJECT:
-                vertical_kill_rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-            if tile['type'] in RIGHT_KILLABLE_OBJECT:
-                horizontal_kill_rects.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-            if tile['type'] in CHECKPOINTS:
-                checkpoints.append(pygame.Rect(tile['pos'][0] * self.tile_size, tile['pos'][1] * self.tile_size, self.tile_size, self.tile_size))
-        return [rects, vertical_kill_rects, horizontal_kill_rects]
-    
-    # Autotiles the placed blocks, with the autotilemap
+        x, y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk:
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+            if chunk.classes[index] == SOLID:
+                return {'type': self.tile_types[chunk.types[index]], 'variant': chunk.variants[index], 'pos': [x, y]}
+
+    # Follows a point moving sideways from x0 to x1 at height y, returns the x of the first solid tile column it runs into, or None if there is none
+    # Every tile between the two is checked, so something moving faster than a tile per step can't skip over a wall
+    # The tile the point starts in is only checked if the point stays in it, otherwise it was already checked at the end of the last move
+    def sweep_x(self, x0, x1, y):
+        size = self.tile_size
+        ty = int(y // size)
+        start, end = int(x0 // size), int(x1 // size)
+        if start == end:
+            columns = (end,)
+        elif end > start:
+            columns = range(start + 1, end + 1)
+        else:
+            columns = range(start - 1, end - 1, -1)
+        chunks = self.chunks
+        row = (ty & CHUNK_MASK) << CHUNK_SHIFT
+        for tx in columns:
+            chunk = chunks.get((tx >> CHUNK_SHIFT, ty >> CHUNK_SHIFT))
+            if chunk and chunk.classes[row | (tx & CHUNK_MASK)] == SOLID:
+                return tx
+        return None
+
+    # Finds the solid blocks, spikes and unclaimed checkpoints touching a rect or one tile away from it, all in one pass over the collision layer
+    # Returns the shared CollisionQuery, so the result is only valid until the next call
+    def physics_rects_around(self, rect):
+        query = self.collision_query
+        query.reset()
+        used = 0
+        for y in range(rect.top // self.tile_size - 1, (rect.bottom - 1) // self.tile_size + 2):
+            for x in range(rect.left // self.tile_size - 1, (rect.right - 1) // self.tile_size + 2):
+                chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+                if not chunk:
+                    continue
+                index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+                tile_class = chunk.classes[index]
+                if tile_class == NO_COLLISION or (tile_class == CHECKPOINT and chunk.variants[index] != 0):
+                    continue
+                # Take a rect from the pool, the pool only grows the first time a query needs more rects than before
+                if used == len(query.rect_pool):
+                    query.rect_pool.append(pygame.Rect(0, 0, 0, 0))
+                tile_rect = query.rect_pool[used]
+                used += 1
+                tile_rect.update(x * self.tile_size, y * self.tile_size, self.tile_size, self.tile_size)
+                if tile_class == CHECKPOINT:
+                    query.checkpoints.append(tile_rect)
+                    query.checkpoint_cells.append((x, y))
+                else:
+                    query.layers[tile_class - SOLID].append(tile_rect)
+        return query
+
+    # Autotiles one tile, its variant comes from which of its four neighbours have the same type
+    def autotile_at(self, x, y):
+        variant = self.autotile_variant(x, y)
+        if variant is not None:
+            self.set_tile((x, y), self.tile_types[self.tile_at(x, y)[0]], variant)
+
+    # Returns the variant autotiling gives the tile at a grid position, or None if it keeps the one it has
+    def autotile_variant(self, x, y):
+        tile = self.tile_at(x, y)
+        if tile and self.tile_types[tile[0]] in AUTOTILE_TYPES:
+            mask = 0
+            for bit, shift in AUTOTILE_SHIFTS:
+                neighbour = self.tile_at(x + shift[0], y + shift[1])
+                if neighbour and neighbour[0] == tile[0]:
+                    mask |= bit
+            variant = AUTOTILE_MASKS[mask]
+            if variant is not None and variant != tile[1]:
+                return variant
+
+    # Autotiles a grid position and its four neighbours, the only tiles that can change when a tile is placed or removed there
+    def autotile_around(self, pos):
+        x, y = int(pos[0]), int(pos[1])
+        self.autotile_at(x, y)
+        for bit, shift in AUTOTILE_SHIFTS:
+            self.autotile_at(x + shift[0], y + shift[1])
+
+    # Region operations, they change many cells at once with write_cells
+    # They return what write_cells returns, so the editor journal can undo them, and the offgrid tiles they added or removed
+
+    # Writes many cells at once, changes is {(x, y): [type, variant] or None for an empty cell}
+    # The cells go straight into the chunk arrays, afterwards the changed cells and their neighbours are autotiled in one pass
+    # and every chunk that changed throws its pre-rendered surfaces away once
+    # Returns {(x, y): [type, variant] or None} with what every cell that changed was before, the ones autotiling changed included
+    def write_cells(self, changes, autotile=True):
+        before = {}
+        keys = set()
+        for (x, y), state in changes.items():
+            key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+            chunk = self.chunks.get(key)
+            index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+            old = chunk.types[index] if chunk else EMPTY
+            if state:
+                type_id = self.type_id(state[0])
+                if old == type_id and chunk.variants[index] == state[1]:
+                    continue
+                if not chunk:
+                    chunk = self.chunks[key] = TileChunk()
+                before[(x, y)] = [self.tile_types[old], chunk.variants[index]] if old != EMPTY else None
+                self.index_cell((x, y), (old, chunk.variants[index]) if old != EMPTY else None, (type_id, state[1]))
+                if old == EMPTY:
+                    chunk.count += 1
+                chunk.types[index] = type_id
+                chunk.variants[index] = state[1]
+                chunk.classes[index] = self.type_classes[type_id]
+            else:
+                if old == EMPTY:
+                    continue
+                before[(x, y)] = [self.tile_types[old], chunk.variants[index]]
+                self.index_cell((x, y), (old, chunk.variants[index]), None)
+                chunk.types[index] = EMPTY
+                chunk.variants[index] = 0
+                chunk.classes[index] = NO_COLLISION
+                chunk.count -= 1
+            if self.stream is not None: # marked right away, a streamed chunk could be thrown out by the next get
+                self.stream.changed.add(key)
+            keys.add(key)
+
+        if autotile:
+            cells = set(before)
+            for x, y in before:
+                for bit, shift in AUTOTILE_SHIFTS:
+                    cells.add((x + shift[0], y + shift[1]))
+            for x, y in cells:
+                variant = self.autotile_variant(x, y)
+                if variant is not None:
+                    key = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+                    chunk = self.chunks.get(key)
+                    index = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+                    if (x, y) not in before:
+                        before[(x, y)] = [self.tile_types[chunk.types[index]], chunk.variants[index]]
+                    self.index_cell((x, y), (chunk.types[index], chunk.variants[index]), (chunk.types[index], variant))
+                    chunk.variants[index] = variant
+                    if self.stream is not None:
+                        self.stream.changed.add(key)
+                    keys.add(key)
+
+        for key in keys:
+            chunk = self.chunks.get(key)
+            if chunk and not chunk.count:
+                del self.chunks[key]
+            self.chunk_surfs.pop(key, None)
+            self.forget_outlines(key)
+        return before
+
+    # Fills a rect of grid cells with one tile
+    def fill_rect(self, rect, tile_type, variant=0):
+        rect = pygame.Rect(rect)
+        return self.write_cells({(x, y): [tile_type, variant] for x in range(rect.left, rect.right) for y in range(rect.top, rect.bottom)})
+
+    # The offgrid tiles placed inside a rect of grid cells, the top left corner of a tile is where it is placed and always inside its image
+    def offgrid_in_rect(self, rect):
+        rect = pygame.Rect(rect)
+        pixels = pygame.Rect(rect.x * self.tile_size, rect.y * self.tile_size, rect.w * self.tile_size, rect.h * self.tile_size)
+        return [tile for tile in self.offgrid_overlapping(pixels) if pixels.collidepoint(tile['pos'])]
+
+    # Removes every tile inside a rect of grid cells, returns (before, removed offgrid tiles)
+    def clear_rect(self, rect):
+        rect = pygame.Rect(rect)
+        before = self.write_cells({(x, y): None for x in range(rect.left, rect.right) for y in range(rect.top, rect.bottom)})
+        removed = self.offgrid_in_rect(rect)
+        self.remove_offgrid_tiles(removed)
+        return before, removed
+
+    # Copies a rect of grid cells and the offgrid tiles inside it into a prefab
+    def copy_rect(self, rect):
+        rect = pygame.Rect(rect)
+        tiles = []
+        for x in range(rect.left, rect.right):
+            for y in range(rect.top, rect.bottom):
+                state = self.tile_state(x, y)
+                if state:
+                    tiles.append([x - rect.x, y - rect.y] + state)
+        offgrid = []
+        for tile in self.offgrid_in_rect(rect):
+            offgrid.append({'type': tile['type'], 'variant': tile['variant'], 'pos': [tile['pos'][0] - rect.x * self.tile_size, tile['pos'][1] - rect.y * self.tile_size]})
+        return {'size': [rect.w, rect.h], 'tiles': tiles, 'offgrid': offgrid}
+
+    # Stamps a prefab with its top left corner at a grid position, the empty cells of the prefab leave the map as it is
+    # Returns (before, added offgrid tiles)
+    def paste(self, prefab, pos):
+        x, y = int(pos[0]), int(pos[1])
+        before = self.write_cells({(x + tile[0], y + tile[1]): [tile[2], tile[3]] for tile in prefab['tiles']})
+        added = []
+        for tile in prefab['offgrid']:
+            tile = {'type': tile['type'], 'variant': tile['variant'], 'pos': [tile['pos'][0] + x * self.tile_size, tile['pos'][1] + y * self.tile_size]}
+            self.add_offgrid(tile)
+            added.append(tile)
+        return before, added
+
+    # Fills the cells connected to a grid position that have the same tile type as it (or are empty like it) with a tile
+    # Empty space is only filled inside the bounds of the map, nothing is filled if more than limit cells would change
+    def flood_fill(self, pos, tile_type, variant=0, limit=FLOOD_LIMIT):
+        x, y = int(pos[0]), int(pos[1])
+        start = self.tile_at(x, y)
+        target = start[0] if start else EMPTY
+        if start and self.tile_types[target] == tile_type:
+            return {}
+        bounds = self.bounds() if target == EMPTY else None
+        if bounds and not (bounds[0] <= x <= bounds[1] and bounds[2] <= y <= bounds[3]):
+            return {}
+        cells = {(x, y)}
+        todo = [(x, y)]
+        while todo:
+            x, y = todo.pop()
+            for bit, shift in AUTOTILE_SHIFTS:
+                cell = (x + shift[0], y + shift[1])
+                if cell in cells:
+                    continue
+                if bounds and not (bounds[0] <= cell[0] <= bounds[1] and bounds[2] <= cell[1] <= bounds[3]):
+                    continue
+                tile = self.tile_at(cell[0], cell[1])
+                if (tile[0] if tile else EMPTY) == target:
+                    cells.add(cell)
+                    todo.append(cell)
+                    if len(cells) > limit:
+                        return {}
+        return self.write_cells({cell: [tile_type, variant] for cell in cells})
+
+    # Autotiles every tile on the grid, one chunk at a time
+    # The neighbours inside the chunk are read straight from its arrays, only the cells on the edge look at the chunk next to it
     def autotile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            neighbours = set()
-            for shift in [(1, 0),(-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile['pos'][0] + shift[0]) + ';' + str(tile['pos'][1] + shift[1])
-                if check_loc in self.tilemap:
-                    if self.tilemap[check_loc]['type'] == tile['type']:
-                        neighbours.add(shift)
-            neighbours = tuple(sorted(neighbours))
-            if (tile['type'] in AUTOTILE_TYPES) and (neighbours in AUTOTILE_MAP):
-                tile['variant'] = AUTOTILE_MAP[neighbours]
-
-
-    # Renders all the blocks in the tilemap to the screen
-    def render(self, surf, offset=(0, 0)):
-
-        for tile in self.offgrid_tiles:
-            surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] - offset[0], tile['pos'][1] - offset[1]))
-
-        for x in range(offset[0] // self.tile_size, (offset[0] + surf.get_width()) // self.tile_size + 1):
-            for y in range(offset[1] // self.tile_size, (offset[1] + surf.get_height()) // self.tile_size + 1):
-                loc = str(x) + ';' + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
-                    surf.blit(self.game.assets[tile['type']][tile['variant']], (tile['pos'][0] * self.tile_size - offset[0], tile['pos'][1] * self.tile_size - offset[1]))
+        type_ids = {self.tile_type_ids[tile_type] for tile_type in AUTOTILE_TYPES if tile_type in self.tile_type_ids}
+        if not type_ids:
+            return
+        keys = self.stream.level_keys(AUTOTILE_TYPES) if self.stream is not None else list(self.chunks)
+        last = CHUNK_MASK << CHUNK_SHIFT # index of the first cell of the last row
+        for key in keys:
+            chunk = self.chunks.get(key)
+            if not chunk:
+                continue
+            cx, cy = key
+            right, left, up, down = self.chunks.get((cx + 1, cy)), self.chunks.get((cx - 1, cy)), self.chunks.get((cx, cy - 1)), self.chunks.get((cx, cy + 1))
+            types, variants = chunk.types, chunk.variants
+            changed = False
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                type_id = types[index]
+                if type_id not in type_ids:
+                    continue
+                x, y = index & CHUNK_MASK, index >> CHUNK_SHIFT
+                mask = 0
+                if (types[index + 1] if x < CHUNK_MASK else right and right.types[index - CHUNK_MASK]) == type_id:
+                    mask |= 1
+                if (types[index - 1] if x else left and left.types[index + CHUNK_MASK]) == type_id:
+                    mask |= 2
+                if (types[index - CHUNK_SIZE] if y else up and up.types[index + last]) == type_id:
+                    mask |= 4
+                if (types[index + CHUNK_SIZE] if y < CHUNK_MASK else down and down.types[index - last]) == type_id:
+                    mask |= 8
+                variant = AUTOTILE_MASKS[mask]
+                if variant is not None and variant != variants[index]:
+                    pos = ((cx << CHUNK_SHIFT) | x, (cy << CHUNK_SHIFT) | y)
+                    self.index_cell(pos, (type_id, variants[index]), (type_id, variant))
+                    variants[index] = variant
+                    changed = True
+            if changed:
+                if self.stream is not None:
+                    self.stream.changed.add(key)
+                self.chunk_surfs.pop(key, None)
+                self.forget_outlines(key)
+
+    # Pre-renders a list of (atlas image, pixel position) onto one surface just big enough to hold them, returns (surface, pixel position) or None if there is nothing to draw
+    def bake(self, images):
+        if not images:
+            return None
+        area = pygame.Rect(images[0][1], images[0][0].get_size()).unionall([pygame.Rect(pos, img.get_size()) for img, pos in images])
+        surf = pygame.Surface(area.size)
+        surf.blits([(img.page, (pos[0] - area.x, pos[1] - area.y), img.rect) for img, pos in images], doreturn=False)
+        surf.set_colorkey((0, 0, 0), pygame.RLEACCEL) # black is see-through just like in the tile images, RLE makes blitting the mostly static surface faster
+        return surf, area.topleft
+
+    # Pre-renders the grid tiles of a chunk
+    def bake_chunk(self, key):
+        images = []
+        chunk = self.chunks.get(key)
+        if chunk:
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                if chunk.types[index] != EMPTY:
+                    x = (key[0] << CHUNK_SHIFT) | (index & CHUNK_MASK)
+                    y = (key[1] << CHUNK_SHIFT) | (index >> CHUNK_SHIFT)
+                    images.append((self.game.assets[self.tile_types[chunk.types[index]]][chunk.variants[index]], (x * self.tile_size, y * self.tile_size)))
+        return self.bake(images)
+
+    # Pre-renders the part of every offgrid tile that is inside a chunk, in list order so overlapping decorations stack the same way in every chunk
+    def bake_offgrid_chunk(self, key):
+        if key not in self.offgrid_chunks:
+            return None
+        chunk_px = CHUNK_SIZE * self.tile_size
+        surf = pygame.Surface((chunk_px, chunk_px))
+        for tile in self.offgrid_chunks[key]:
+            img = self.game.assets[tile['type']][tile['variant']]
+            surf.blit(img.page, (int(tile['pos'][0]) - key[0] * chunk_px, int(tile['pos'][1]) - key[1] * chunk_px), img.rect)
+        surf.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        return surf, (key[0] * chunk_px, key[1] * chunk_px)
+
+    # Pre-renders the outline of everything inside a chunk, tiles from the chunks around it included
+    # The shape is taken from one pixel more than the chunk on every side, so the outline is the same as if the whole map was outlined at once
+    def bake_outline(self, key, offsets):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        area = pygame.Rect(key[0] * chunk_px - 1, key[1] * chunk_px - 1, chunk_px + 2, chunk_px + 2)
+        shape = pygame.Surface(area.size, pygame.SRCALPHA)
+        found = False
+        for surfs, bake in [(self.offgrid_surfs, self.bake_offgrid_chunk), (self.chunk_surfs, self.bake_chunk)]:
+            for cx in range(key[0] - 1, key[0] + 2):
+                for cy in range(key[1] - 1, key[1] + 2):
+                    if (cx, cy) not in surfs:
+                        surfs[(cx, cy)] = bake((cx, cy))
+                    if surfs[(cx, cy)]:
+                        chunk_surf, pos = surfs[(cx, cy)]
+                        if area.colliderect(pygame.Rect(pos, chunk_surf.get_size())):
+                            shape.blit(chunk_surf, (pos[0] - area.x, pos[1] - area.y))
+                            found = True
+        if not found:
+            return None
+        mask = pygame.mask.from_surface(shape)
+        if not mask.count():
+            return None
+        silhouette = mask.to_surface(setcolor=OUTLINE_COLOR, unsetcolor=(0, 0, 0, 0))
+        outline = pygame.Surface((chunk_px, chunk_px), pygame.SRCALPHA)
+        for offset in offsets:
+            outline.blit(silhouette, (offset[0] - 1, offset[1] - 1))
+        return outline
+
+    # Renders all the blocks in the tilemap to the screen, one pre-rendered surface per chunk, chunks are only rendered again after a tile in them changes
+    # If an outline layer is given, the pre-rendered outline of every chunk is drawn on it
+    def render(self, surf, offset=(0, 0), outline=None):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        # Grid tiles can be bigger than a cell and stick out of their chunk to the right and down, so one extra chunk to the left and up is checked
+        x_range = range(offset[0] // chunk_px - 1, (offset[0] + surf.get_width()) // chunk_px + 1)
+        y_range = range(offset[1] // chunk_px - 1, (offset[1] + surf.get_height()) // chunk_px + 1)
+
+        # Offgrid tiles are drawn first so the grid is on top of them
+        for surfs, bake in [(self.offgrid_surfs, self.bake_offgrid_chunk), (self.chunk_surfs, self.bake_chunk)]:
+            for cx in x_range:
+                for cy in y_range:
+                    key = (cx, cy)
+                    if key not in surfs:
+                        surfs[key] = bake(key)
+                    if surfs[key]:
+                        chunk_surf, pos = surfs[key]
+                        surf.blit(chunk_surf, (pos[0] - offset[0], pos[1] - offset[1]))
+
+        if outline:
+            for cx in x_range:
+                for cy in y_range:
+                    outlines = self.outline_surfs.setdefault((cx, cy), {})
+                    if outline.offsets not in outlines:
+                        outlines[outline.offsets] = self.bake_outline((cx, cy), outline.offsets)
+                    if outlines[outline.offsets]:
+                        outline.surf.blit(outlines[outline.offsets], (cx * chunk_px - offset[0], cy * chunk_px - offset[1]))